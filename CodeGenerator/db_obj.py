@@ -1,6 +1,14 @@
+import argparse
+import fnmatch
+import hashlib
+import json
 import os
-from sqlalchemy import create_engine, inspect
-from jinja2 import Template
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, inspect, text
+from sqlalchemy.engine.reflection import ObjectKind
+from jinja2 import DictLoader, Environment
 import config  # Import the config file
 
 # Use the values from the config.py file
@@ -159,6 +167,20 @@ public class {{ class_name }}Controller {
 }
 """
 
+# Shared Jinja2 environment: each template is compiled once and cached for every table
+template_env = Environment(loader=DictLoader({
+    'entity': java_entity_template,
+    'view_repository': view_repository_template,
+    'table_repository': table_repository_template,
+    'service': service_template,
+    'controller': controller_template,
+}))
+
+# Manifest of the generated files, kept in the Java project folder
+manifest_file = os.path.join(java_project_folder, '.db_obj_manifest.json')
+manifest_lock = threading.Lock()
+manifest = {}
+
 # Mapping of MySQL types to Java types
 type_mapping = {
     "INTEGER": "Integer",
@@ -183,16 +205,12 @@ def is_auto_increment_column(column):
     # Only allow auto-increment for integer-like columns
     return column['type'].__class__.__name__.upper() in ['INTEGER', 'BIGINT'] and column.get('autoincrement', False)
 
-# Function to get column details from the table
-def get_columns(table_name):
-    inspector = inspect(engine)
-    
-    # Get primary key column(s) from the table
-    pk_constraint = inspector.get_pk_constraint(table_name)
+# Function to build the column details of a table from its reflected columns and primary key constraint
+def column_details(reflected_columns, pk_constraint):
     primary_keys = pk_constraint.get('constrained_columns', [])  # List of primary key column names
     
     columns = []
-    for column in inspector.get_columns(table_name):
+    for column in reflected_columns:
         column_name = column['name']
         is_primary_key = column_name in primary_keys  # Check if the column is in the list of primary keys
         is_auto_increment = is_auto_increment_column(column) if is_primary_key else False  # Direct access to 'autoincrement'
@@ -211,21 +229,91 @@ def get_columns(table_name):
         })
     return columns
 
+# Function to get the column details of many tables and views at once: the columns and primary keys are
+# reflected in one bulk pass each instead of two queries per table
+def get_multi_columns(table_names, inspector=None):
+    inspector = inspector or inspect(engine)
+    reflected_columns = inspector.get_multi_columns(kind=ObjectKind.ANY, filter_names=table_names)
+    pk_constraints = inspector.get_multi_pk_constraint(kind=ObjectKind.ANY, filter_names=table_names)
+    return {
+        table_name: column_details(reflected, pk_constraints.get((schema_name, table_name), {}))
+        for (schema_name, table_name), reflected in reflected_columns.items()
+    }
+
+# Function to reflect the schema once: the table and view names, with column details
+# (primary keys, auto-increment flags, lengths) added per object by reflect_columns
+def load_schema_model():
+    inspector = inspect(engine)
+    return {
+        'tables': inspector.get_table_names(),
+        'views': inspector.get_view_names(),
+        'columns': {},
+    }
 
+# Function to add the column details of the given objects to the schema model, reflecting only the missing ones
+def reflect_columns(schema, table_names):
+    missing = [table_name for table_name in table_names if table_name not in schema['columns']]
+    if missing:
+        schema['columns'].update(get_multi_columns(missing))
+    return schema
+
+# Function to read a schema model saved by save_schema_cache
+def load_schema_cache(path):
+    with open(path) as f:
+        return json.load(f)
+
+# Function to save the schema model so later runs can start without reflecting the database
+def save_schema_cache(path, schema):
+    with open(path, 'w') as f:
+        json.dump(schema, f, indent=2)
 
 # Function to check if the object is a view
-def is_view(table_name):
-    inspector = inspect(engine)
-    return table_name in inspector.get_view_names()
+def is_view(table_name, schema):
+    return table_name in schema['views']
+
+# Function to read the manifest of previously generated files
+def load_manifest():
+    if os.path.exists(manifest_file):
+        with open(manifest_file) as f:
+            manifest.update(json.load(f))
+
+# Function to save the manifest of generated files
+def save_manifest():
+    with open(manifest_file, 'w') as f:
+        json.dump(manifest, f, indent=2, sort_keys=True)
+
+# Function to write a generated file only when its content changed, so the Java build keeps unchanged classes,
+# and to record it in the manifest
+def write_generated_file(table_name, kind, output_file, rendered):
+    content_hash = hashlib.sha256(rendered.encode('utf-8')).hexdigest()
+
+    existing_hash = None
+    if os.path.exists(output_file):
+        with open(output_file) as f:
+            existing_hash = hashlib.sha256(f.read().encode('utf-8')).hexdigest()
+
+    if existing_hash == content_hash:
+        print(f"Unchanged {kind}: {output_file}")
+    else:
+        with open(output_file, 'w') as f:
+            f.write(rendered)
+        print(f"Generated {kind}: {output_file}")
+
+    with manifest_lock:
+        manifest[os.path.relpath(output_file, java_project_folder)] = {
+            'table': table_name,
+            'kind': kind,
+            'sha256': content_hash,
+        }
 
 # Function to generate the entity class file
-def generate_entity(table_name):
+def generate_entity(table_name, schema):
     # Get columns and generate class name
-    columns = get_columns(table_name)
+    columns = schema['columns'][table_name]
     class_name = generate_class_name(table_name)
 
     # Use Jinja2 to render the entity template
-    template = Template(java_entity_template)
+    template = template_env.get_template('entity')
     rendered = template.render(
         package_name=package_name,
         table_name=table_name,
@@ -238,19 +326,16 @@ def generate_entity(table_name):
     os.makedirs(output_folder, exist_ok=True)
     output_file = os.path.join(output_folder, f"{class_name}.java")
 
-    with open(output_file, 'w') as f:
-        f.write(rendered)
-
-    print(f"Generated entity: {output_file}")
+    write_generated_file(table_name, 'entity', output_file, rendered)
 
 # Function to generate the service class file directly
-def generate_service(table_name):
+def generate_service(table_name, schema):
     class_name = generate_class_name(table_name)
     camel_class_name = to_camel_case(class_name)
-    is_view_flag = is_view(table_name)
+    is_view_flag = is_view(table_name, schema)
 
     # Use Jinja2 to render the service template
-    template = Template(service_template)
+    template = template_env.get_template('service')
     rendered = template.render(
         package_name=package_name,
         class_name=class_name,
@@ -263,19 +348,16 @@ def generate_service(table_name):
     os.makedirs(output_folder, exist_ok=True)
     output_file = os.path.join(output_folder, f"{class_name}Service.java")
 
-    with open(output_file, 'w') as f:
-        f.write(rendered)
-
-    print(f"Generated service: {output_file}")
+    write_generated_file(table_name, 'service', output_file, rendered)
 
 # Function to generate the controller class file
-def generate_controller(table_name):
+def generate_controller(table_name, schema):
     class_name = generate_class_name(table_name)
     camel_class_name = to_camel_case(class_name)
-    is_view_flag = is_view(table_name)
+    is_view_flag = is_view(table_name, schema)
 
     # Use Jinja2 to render the controller template
-    template = Template(controller_template)
+    template = template_env.get_template('controller')
     rendered = template.render(
         package_name=package_name,
         class_name=class_name,
@@ -288,22 +370,19 @@ def generate_controller(table_name):
     os.makedirs(output_folder, exist_ok=True)
     output_file = os.path.join(output_folder, f"{class_name}Controller.java")
 
-    with open(output_file, 'w') as f:
-        f.write(rendered)
-
-    print(f"Generated controller: {output_file}")
+    write_generated_file(table_name, 'controller', output_file, rendered)
 
 # Function to generate the repository file
-def generate_repository(table_name):
+def generate_repository(table_name, schema):
     class_name = generate_class_name(table_name)
     
     # Determine if it's a view or a table
-    if is_view(table_name):
+    if is_view(table_name, schema):
         # Use the view repository template
-        template = Template(view_repository_template)
+        template = template_env.get_template('view_repository')
     else:
         # Use the table repository template
-        template = Template(table_repository_template)
+        template = template_env.get_template('table_repository')
 
     rendered = template.render(
         package_name=package_name,
@@ -315,62 +394,212 @@ def generate_repository(table_name):
     os.makedirs(output_folder, exist_ok=True)
     output_file = os.path.join(output_folder, f"{class_name}Repository.java")
 
-    with open(output_file, 'w') as f:
-        f.write(rendered)
-
-    print(f"Generated repository: {output_file}")
+    write_generated_file(table_name, 'repository', output_file, rendered)
 
 # Function to list all tables and views in the database
-def list_tables():
-    inspector = inspect(engine)
-    # Get both tables and views
-    tables = inspector.get_table_names()  # Get the tables
-    views = inspector.get_view_names()    # Get the views
-    return tables + views  # Merge tables and views into one list
-
-
-# Main code
-if __name__ == "__main__":
-    # List available tables and views
-    tables = list_tables()
-    print("Available tables/views:")
-    for idx, table in enumerate(tables):
-        print(f"{idx + 1}. {table}")
-
-    # Let the user select a table
-    choice = int(input("Select a table by number: ")) - 1
-    selected_table = tables[choice]
-
-    # Ask the user what to generate
-    print("\nSelect what to generate:")
-    print("Press Enter to generate all files (Entity, Repository, Service, Controller).")
-    print("1: Entity only")
-    print("2: Entity and Repository")
-    print("3: Entity, Repository, and Service")
-    
-    user_input = input("Your choice: ").strip()
+def list_tables(schema):
+    # Merge tables and views into one list
+    return schema['tables'] + schema['views']
+
+# Files generated for each choice, in generation order
+GENERATION_CHOICES = {
+    'entity': ['entity'],
+    'repository': ['entity', 'repository'],
+    'service': ['entity', 'repository', 'service'],
+    'all': ['entity', 'repository', 'service', 'controller'],
+}
 
-    # Generate based on the user's choice
-    if user_input == "1":
-        print(f"Generating entity for {selected_table}...")
-        generate_entity(selected_table)
+# Function to pick the tables for batch mode from all tables, a glob pattern or an explicit list
+def select_batch_tables(available_tables, pattern=None, table_names=None):
+    if table_names:
+        unknown = [table for table in table_names if table not in available_tables]
+        if unknown:
+            raise SystemExit(f"Unknown tables/views: {', '.join(unknown)}")
+        return table_names
+    if pattern:
+        return [table for table in available_tables if fnmatch.fnmatch(table, pattern)]
+    return available_tables
+
+# Function to generate the chosen files for one table from the schema model
+def generate_table_files(table_name, choice, schema):
+    for kind in GENERATION_CHOICES[choice]:
+        if kind == 'entity':
+            generate_entity(table_name, schema)
+        elif kind == 'repository':
+            generate_repository(table_name, schema)
+        elif kind == 'service':
+            generate_service(table_name, schema)
+        elif kind == 'controller':
+            generate_controller(table_name, schema)
+
+# Function to generate code for many tables in one run: columns are reflected once into the schema model,
+# then rendering and file writes run in parallel across tables
+def batch_generate(table_names, schema, choice='all', jobs=4):
+    reflect_columns(schema, table_names)
+
+    def generate(table_name):
+        try:
+            generate_table_files(table_name, choice, schema)
+        except Exception as e:
+            print(f"Failed to generate files for {table_name}: {e}")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        list(executor.map(generate, table_names))
+
+# Function to fingerprint the column definitions of every table and view. On MySQL this is a single
+# information_schema query; other databases fall back to reflecting the columns
+def fetch_schema_fingerprints():
+    if engine.dialect.name != 'mysql':
+        return {
+            table_name: hashlib.sha256(json.dumps(columns, sort_keys=True).encode('utf-8')).hexdigest()
+            for table_name, columns in get_multi_columns(None).items()
+        }
 
-    elif user_input == "2":
-        print(f"Generating entity and repository for {selected_table}...")
-        generate_entity(selected_table)
-        generate_repository(selected_table)
+    query = text("""
+        SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE, IS_NULLABLE, COLUMN_KEY, EXTRA
+        FROM information_schema.COLUMNS
+        WHERE TABLE_SCHEMA = DATABASE()
+        ORDER BY TABLE_NAME, ORDINAL_POSITION
+    """)
+    digests = {}
+    with engine.connect() as conn:
+        for row in conn.execute(query):
+            column_definition = '|'.join(str(value) for value in row[1:])
+            digests.setdefault(row[0], hashlib.sha256()).update(column_definition.encode('utf-8') + b'\n')
+    return {table_name: digest.hexdigest() for table_name, digest in digests.items()}
+
+# Function to keep the generated code in sync with the database: poll the column fingerprints
+# and regenerate only the watched tables whose columns changed (or that were created)
+def watch_schema(schema, choice, interval, jobs, pattern=None, table_names=None, schema_cache=None):
+    def watched(names):
+        return [name for name in names
+                if (table_names is None or name in table_names)
+                and (pattern is None or fnmatch.fnmatch(name, pattern))]
+
+    fingerprints = fetch_schema_fingerprints()
+    print(f"Watching {len(watched(fingerprints))} tables/views every {interval}s (Ctrl+C to stop)...")
+    try:
+        while True:
+            time.sleep(interval)
+            try:
+                current = fetch_schema_fingerprints()
+            except Exception as e:
+                print(f"Failed to check the schema: {e}")
+                continue
+
+            changed = watched(name for name in current if fingerprints.get(name) != current[name])
+            dropped = watched(name for name in fingerprints if name not in current)
+            fingerprints = current
+            if dropped:
+                print(f"Dropped tables/views (generated files are kept): {', '.join(dropped)}")
+            if not changed:
+                continue
+
+            # Refresh the names and drop the stale column details of the changed tables only
+            refreshed = load_schema_model()
+            refreshed['columns'] = {name: columns for name, columns in schema['columns'].items()
+                                    if name in current and name not in changed}
+            schema = refreshed
+
+            print(f"Schema changed for {', '.join(changed)}, regenerating {choice} files...")
+            batch_generate(changed, schema, choice, jobs)
+            save_manifest()
+            if schema_cache:
+                reflect_columns(schema, list_tables(schema))
+                save_schema_cache(schema_cache, schema)
+    except KeyboardInterrupt:
+        print("Stopped watching.")
 
-    elif user_input == "3":
-        print(f"Generating entity, repository, and service for {selected_table}...")
-        generate_entity(selected_table)
-        generate_repository(selected_table)
-        generate_service(selected_table)
 
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Generate Spring Boot code from database tables and views.")
+    parser.add_argument("--all", action="store_true", help="Generate code for every table and view without prompting")
+    parser.add_argument("--pattern", help="Generate code for the tables and views matching this glob, e.g. 'order_*'")
+    parser.add_argument("--tables", help="Generate code for this comma-separated list of tables and views")
+    parser.add_argument("--generate", choices=GENERATION_CHOICES.keys(), default='all',
+                        help="Files to generate in batch mode, cumulative like the interactive menu (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="Number of tables generated in parallel in batch mode (default: %(default)s)")
+    parser.add_argument("--schema-cache", metavar="PATH",
+                        help="Load the reflected schema from this file if it exists, otherwise reflect the whole schema and save it there")
+    parser.add_argument("--refresh-schema", action="store_true",
+                        help="Reflect the database again and overwrite the --schema-cache file")
+    parser.add_argument("--watch", type=float, metavar="SECONDS",
+                        help="Keep running and regenerate the tables whose columns change, polling every SECONDS "
+                             "(limited to --pattern/--tables if given)")
+    args = parser.parse_args()
+
+    # Reflect the schema once (or load it from the cache) and share it with every generator
+    if args.schema_cache and os.path.exists(args.schema_cache) and not args.refresh_schema:
+        schema = load_schema_cache(args.schema_cache)
+        print(f"Loaded schema from {args.schema_cache}")
     else:
-        print(f"Generating all files for {selected_table} (Entity, Repository, Service, Controller)...")
-        generate_entity(selected_table)
-        generate_repository(selected_table)
-        generate_service(selected_table)
-        generate_controller(selected_table)
+        schema = load_schema_model()
+        if args.schema_cache:
+            reflect_columns(schema, list_tables(schema))
+            save_schema_cache(args.schema_cache, schema)
+            print(f"Saved schema to {args.schema_cache}")
+
+    load_manifest()
+
+    # Watch mode: regenerate only what changes until interrupted
+    if args.watch:
+        table_names = [table.strip() for table in args.tables.split(',')] if args.tables else None
+        watch_schema(schema, args.generate, args.watch, args.jobs, args.pattern, table_names, args.schema_cache)
+
+    # Batch mode: no prompts, one reflection for the whole schema
+    elif args.all or args.pattern or args.tables:
+        table_names = [table.strip() for table in args.tables.split(',')] if args.tables else None
+        selected_tables = select_batch_tables(list_tables(schema), args.pattern, table_names)
+        print(f"Generating {args.generate} files for {len(selected_tables)} tables/views...")
+        batch_generate(selected_tables, schema, args.generate, args.jobs)
+        save_manifest()
+        print("Generation complete.")
 
-    print("Generation complete.")
+    else:
+        # List available tables and views
+        tables = list_tables(schema)
+        print("Available tables/views:")
+        for idx, table in enumerate(tables):
+            print(f"{idx + 1}. {table}")
+
+        # Let the user select a table
+        choice = int(input("Select a table by number: ")) - 1
+        selected_table = tables[choice]
+        reflect_columns(schema, [selected_table])
+
+        # Ask the user what to generate
+        print("\nSelect what to generate:")
+        print("Press Enter to generate all files (Entity, Repository, Service, Controller).")
+        print("1: Entity only")
+        print("2: Entity and Repository")
+        print("3: Entity, Repository, and Service")
+    
+        user_input = input("Your choice: ").strip()
+
+        # Generate based on the user's choice
+        if user_input == "1":
+            print(f"Generating entity for {selected_table}...")
+            generate_entity(selected_table, schema)
+
+        elif user_input == "2":
+            print(f"Generating entity and repository for {selected_table}...")
+            generate_entity(selected_table, schema)
+            generate_repository(selected_table, schema)
+
+        elif user_input == "3":
+            print(f"Generating entity, repository, and service for {selected_table}...")
+            generate_entity(selected_table, schema)
+            generate_repository(selected_table, schema)
+            generate_service(selected_table, schema)
+
+        else:
+            print(f"Generating all files for {selected_table} (Entity, Repository, Service, Controller)...")
+            generate_entity(selected_table, schema)
+            generate_repository(selected_table, schema)
+            generate_service(selected_table, schema)
+            generate_controller(selected_table, schema)
+
+        save_manifest()
+        print("Generation complete.")
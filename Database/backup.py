@@ -0,0 +1,436 @@
+import argparse
+import backup_config
+import hashlib
+import json
+import os
+import shutil
+import subprocess
+import threading
+import time
+from compression import CODECS, decompress_command
+from concurrent.futures import ThreadPoolExecutor
+from datetime import datetime, timedelta
+
+# Size of the blocks read from the compressor and written to the backup file
+CHUNK_SIZE = 1024 * 1024
+
+# Incremental backups: content-addressed dumps under objects/, one manifest per point in time under snapshots/
+INCREMENTAL_DIR = os.path.join(backup_config.backup_dir, 'incremental')
+OBJECTS_DIR = os.path.join(INCREMENTAL_DIR, 'objects')
+SNAPSHOTS_DIR = os.path.join(INCREMENTAL_DIR, 'snapshots')
+
+# Environment for the MySQL clients, passing the password without exposing it in the process list
+def mysql_env():
+    return dict(os.environ, MYSQL_PWD=backup_config.mysql_password)
+
+# Function to pick the compressor: the requested one, or the best one installed
+def select_codec(name=None):
+    if name:
+        if not shutil.which(name):
+            raise SystemExit(f"Compressor '{name}' is not installed.")
+        return name
+    for codec in CODECS:
+        if shutil.which(codec):
+            return codec
+    raise SystemExit("No compressor found, install zstd, pigz or gzip.")
+
+# Function to run a query with the mysql client and return the rows as lists of strings
+def mysql_query(sql):
+    output = subprocess.run(
+        ['mysql', '-h', backup_config.mysql_host, '-u', backup_config.mysql_user, '-N', '-B', '-e', sql],
+        env=mysql_env(), check=True, capture_output=True, text=True
+    ).stdout
+    return [line.split('\t') for line in output.splitlines()]
+
+# Function to list the databases to back up
+def list_databases():
+    if backup_config.databases:
+        return list(backup_config.databases)
+    return [row[0] for row in mysql_query('SHOW DATABASES') if row[0] not in backup_config.excluded_databases]
+
+# Function to back up one database: mysqldump is piped straight into the compressor and the compressed
+# stream is written to the backup file while its size and SHA-256 are computed, so nothing is read twice
+def backup_database(db, output_dir, codec, level, threads):
+    command, extension, _ = CODECS[codec]
+    output_file = os.path.join(output_dir, f"{db}.sql{extension}")
+    start = time.time()
+
+    try:
+        dump = subprocess.Popen(
+            ['mysqldump', '-h', backup_config.mysql_host, '-u', backup_config.mysql_user,
+             *backup_config.mysqldump_options, '--databases', db],
+            env=mysql_env(), stdout=subprocess.PIPE
+        )
+        try:
+            compressor = subprocess.Popen(command(level, threads), stdin=dump.stdout, stdout=subprocess.PIPE)
+        except FileNotFoundError:
+            dump.kill()
+            dump.wait()
+            raise
+        finally:
+            dump.stdout.close()  # Let mysqldump see a broken pipe if the compressor dies
+    except FileNotFoundError as error:
+        # A missing client fails this database only, so the others are still backed up and listed in the manifest
+        print(f"{db}: backup failed ({error})")
+        return {'status': 'failed', 'error': str(error), 'seconds': round(time.time() - start, 2)}
+
+    checksum = hashlib.sha256()
+    size = 0
+    with open(output_file, 'wb') as f:
+        for chunk in iter(lambda: compressor.stdout.read(CHUNK_SIZE), b''):
+            f.write(chunk)
+            checksum.update(chunk)
+            size += len(chunk)
+    compressor.stdout.close()
+
+    dump_status = dump.wait()
+    compressor_status = compressor.wait()
+    seconds = time.time() - start
+
+    if dump_status != 0 or compressor_status != 0:
+        os.remove(output_file)
+        print(f"{db}: backup failed (mysqldump exit {dump_status}, {codec} exit {compressor_status})")
+        return {'status': 'failed', 'seconds': round(seconds, 2)}
+
+    megabytes = size / (1024 * 1024)
+    print(f"{db}: {megabytes:.1f} MB in {seconds:.1f}s ({megabytes / max(seconds, 0.001):.1f} MB/s)")
+    return {
+        'status': 'ok',
+        'file': os.path.basename(output_file),
+        'bytes': size,
+        'sha256': checksum.hexdigest(),
+        'seconds': round(seconds, 2),
+    }
+
+# Function to back up the databases concurrently and write a manifest of the results
+def run_backup(databases, jobs, codec, level):
+    output_dir = os.path.join(backup_config.backup_dir, datetime.now().strftime('%d-%m-%Y'))
+    os.makedirs(output_dir, exist_ok=True)
+
+    # Share the cores between the compressors running at the same time
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+    print(f"Backing up {len(databases)} databases to {output_dir} ({jobs} at a time, {codec} level {level})...")
+
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = dict(zip(databases, executor.map(
+            lambda db: backup_database(db, output_dir, codec, level, threads), databases
+        )))
+
+    manifest = {
+        'created': datetime.now().isoformat(timespec='seconds'),
+        'codec': codec,
+        'level': level,
+        'databases': results,
+    }
+    with open(os.path.join(output_dir, 'manifest.json'), 'w') as f:
+        json.dump(manifest, f, indent=2)
+
+    failed = [db for db, result in results.items() if result['status'] != 'ok']
+    total = sum(result.get('bytes', 0) for result in results.values()) / (1024 * 1024)
+    print(f"Backed up {len(databases) - len(failed)}/{len(databases)} databases, {total:.1f} MB in {time.time() - start:.1f}s.")
+    if failed:
+        print(f"Failed databases: {', '.join(failed)}")
+    return not failed
+
+# Function to delete the dated full-backup folders older than the retention period, always keeping the latest
+def prune_backups(retention_days):
+    dated = []
+    for name in os.listdir(backup_config.backup_dir):
+        try:
+            dated.append((datetime.strptime(name, '%d-%m-%Y'), name))
+        except ValueError:
+            continue  # Not a full-backup folder (the incremental store, other files)
+    cutoff = datetime.now() - timedelta(days=retention_days)
+    for date, name in sorted(dated)[:-1]:
+        if date < cutoff:
+            shutil.rmtree(os.path.join(backup_config.backup_dir, name))
+            print(f"Removed backup {name}")
+
+# Function to build a mysqldump command for one database, optionally limited to some tables
+def mysqldump_command(db, *options, tables=()):
+    return ['mysqldump', '-h', backup_config.mysql_host, '-u', backup_config.mysql_user,
+            *backup_config.mysqldump_options, '--skip-dump-date', *options, db, *tables]
+
+# Function to get the path of a stored object
+def object_path(name):
+    return os.path.join(OBJECTS_DIR, name[:2], name)
+
+# Function to dump into the object store: the uncompressed dump is hashed on its way to the compressor and the
+# result is kept under its hash, so a dump identical to one already stored takes no extra space
+def store_object(command, codec, level, threads):
+    compress_command, extension, _ = CODECS[codec]
+    os.makedirs(OBJECTS_DIR, exist_ok=True)
+    temp_path = os.path.join(OBJECTS_DIR, f"tmp-{os.getpid()}-{threading.get_ident()}{extension}")
+
+    checksum = hashlib.sha256()
+    size = 0
+    dump = subprocess.Popen(command, env=mysql_env(), stdout=subprocess.PIPE)
+    with open(temp_path, 'wb') as f:
+        compressor = subprocess.Popen(compress_command(level, threads), stdin=subprocess.PIPE, stdout=f)
+        try:
+            for chunk in iter(lambda: dump.stdout.read(CHUNK_SIZE), b''):
+                checksum.update(chunk)
+                size += len(chunk)
+                compressor.stdin.write(chunk)
+        except BrokenPipeError:
+            pass
+        finally:
+            dump.stdout.close()
+            compressor.stdin.close()
+        dump_status = dump.wait()
+        compressor_status = compressor.wait()
+
+    if dump_status != 0 or compressor_status != 0:
+        os.remove(temp_path)
+        return None
+
+    name = f"{checksum.hexdigest()}{extension}"
+    path = object_path(name)
+    if os.path.exists(path):
+        os.remove(temp_path)
+        stored = False
+    else:
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        os.replace(temp_path, path)
+        stored = True
+    return {'object': name, 'bytes': size, 'stored': stored}
+
+# Function to build the statement turning off the cache MySQL 8 keeps of the information_schema table times
+# (information_schema_stats_expiry, a day by default). MySQL 5.7 and MariaDB have no such cache and reject the
+# variable (MariaDB also runs /*!80000 */ comments), so it is only used when the server has it
+def stats_expiry_statement():
+    try:
+        supported = mysql_query("SHOW VARIABLES LIKE 'information_schema_stats_expiry'")
+    except subprocess.CalledProcessError:
+        return ""  # The fingerprint queries fail and report the error per database
+    if supported:
+        return "/*!80000 SET SESSION information_schema_stats_expiry = 0 */; "
+    return ""
+
+# Function to read the change fingerprints of the base tables of a database; tables without an UPDATE_TIME
+# (InnoDB forgets it on restart) get no fingerprint and are always dumped. UPDATE_TIME has a resolution of
+# one second, so a table updated in the current second gets no fingerprint either: a later commit in the same
+# second would leave it unchanged. session_setup is run first in the same session
+def fetch_table_fingerprints(db, session_setup=""):
+    rows = mysql_query(
+        f"{session_setup}"
+        "SELECT TABLE_NAME, CREATE_TIME, UPDATE_TIME, NOW() FROM information_schema.TABLES "
+        f"WHERE TABLE_SCHEMA = '{db.replace(chr(39), chr(39) * 2)}' AND TABLE_TYPE = 'BASE TABLE'"
+    )
+    return {table: (f"{create_time}|{update_time}" if update_time != 'NULL' and update_time < now else None)
+            for table, create_time, update_time, now in rows}
+
+# Function to list the saved snapshots, oldest first
+def list_snapshot_names():
+    if not os.path.isdir(SNAPSHOTS_DIR):
+        return []
+    return sorted(name[:-len('.json')] for name in os.listdir(SNAPSHOTS_DIR) if name.endswith('.json'))
+
+# Function to read a snapshot manifest
+def load_snapshot(name):
+    path = os.path.join(SNAPSHOTS_DIR, f"{name}.json")
+    if not os.path.exists(path):
+        raise SystemExit(f"Snapshot '{name}' not found.")
+    with open(path) as f:
+        return json.load(f)
+
+# Function to back up the databases incrementally: every database gets its schema (tables, views, routines, events)
+# and triggers dumped, and each table is dumped on its own unless its fingerprint is unchanged since the last snapshot.
+# Each table is read in its own transaction, so a snapshot is consistent per table but not across tables:
+# rows written to related tables while the backup runs can be in one dump and missing from another
+def run_incremental_backup(databases, jobs, codec, level):
+    snapshot_names = list_snapshot_names()
+    previous = load_snapshot(snapshot_names[-1])['databases'] if snapshot_names else {}
+    threads = max(1, (os.cpu_count() or 1) // jobs)
+
+    session_setup = stats_expiry_statement()
+
+    # One task per object to dump: (db, kind, table, command)
+    tasks = []
+    snapshot = {}
+    skipped = 0
+    for db in databases:
+        snapshot[db] = {'tables': {}, 'failed': []}
+        try:
+            fingerprints = fetch_table_fingerprints(db, session_setup)
+        except subprocess.CalledProcessError as e:
+            # Without its table list nothing of the database is dumped; it is recorded as failed in the snapshot
+            snapshot[db]['failed'].append('tables')
+            print(f"{db}: reading the table fingerprints failed: {e.stderr.strip()}")
+            continue
+        tasks.append((db, 'schema', None, mysqldump_command(db, '--no-data', '--skip-triggers', '--routines', '--events')))
+        tasks.append((db, 'triggers', None, mysqldump_command(db, '--no-data', '--no-create-info', '--triggers')))
+        previous_tables = previous.get(db, {}).get('tables', {})
+        for table, fingerprint in fingerprints.items():
+            earlier = previous_tables.get(table)
+            if (fingerprint and earlier and earlier.get('fingerprint') == fingerprint
+                    and os.path.exists(object_path(earlier['object']))):
+                snapshot[db]['tables'][table] = earlier
+                skipped += 1
+            else:
+                command = mysqldump_command(db, '--single-transaction', '--no-create-info', '--skip-triggers', tables=[table])
+                tasks.append((db, 'table', table, command))
+                snapshot[db]['tables'][table] = {'fingerprint': fingerprint}
+
+    print(f"Incremental backup of {len(databases)} databases: {len(tasks)} dumps, {skipped} unchanged tables skipped...")
+    start = time.time()
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        results = list(executor.map(lambda task: store_object(task[3], codec, level, threads), tasks))
+
+    stored_bytes = 0
+    deduplicated = 0
+    for (db, kind, table, _), result in zip(tasks, results):
+        if result is None:
+            snapshot[db]['failed'].append(table or kind)
+            snapshot[db]['tables'].pop(table, None)
+            print(f"{db}: dump of {table or kind} failed")
+            continue
+        entry = {'object': result['object'], 'bytes': result['bytes']}
+        if kind == 'table':
+            snapshot[db]['tables'][table].update(entry)
+        else:
+            snapshot[db][kind] = entry
+        if result['stored']:
+            stored_bytes += os.path.getsize(object_path(result['object']))
+        else:
+            deduplicated += 1
+
+    # A table written to after its fingerprint was read may have changes its dump doesn't contain. It keeps no
+    # fingerprint, so the next run dumps it again
+    current = {}
+    for (db, kind, table, _), result in zip(tasks, results):
+        if kind != 'table' or result is None:
+            continue
+        if db not in current:
+            try:
+                current[db] = fetch_table_fingerprints(db, session_setup)
+            except subprocess.CalledProcessError:
+                current[db] = {}
+        entry = snapshot[db]['tables'][table]
+        if current[db].get(table) != entry['fingerprint']:
+            entry['fingerprint'] = None
+
+    base_name = name = datetime.now().strftime('%Y-%m-%d_%H%M%S')
+    os.makedirs(SNAPSHOTS_DIR, exist_ok=True)
+    suffix = 0
+    while os.path.exists(os.path.join(SNAPSHOTS_DIR, f"{name}.json")):
+        suffix += 1
+        name = f"{base_name}.{suffix}"
+    with open(os.path.join(SNAPSHOTS_DIR, f"{name}.json"), 'w') as f:
+        json.dump({'created': datetime.now().isoformat(timespec='seconds'), 'databases': snapshot}, f, indent=2)
+
+    failed = [db for db, entry in snapshot.items() if entry['failed']]
+    print(f"Snapshot {name}: {stored_bytes / (1024 * 1024):.1f} MB of new data, "
+          f"{deduplicated} dumps already stored, in {time.time() - start:.1f}s.")
+    if failed:
+        print(f"Databases with failed dumps: {', '.join(failed)}")
+    return not failed
+
+# Function to delete snapshots older than the retention period (always keeping the latest) and the objects
+# no remaining snapshot refers to
+def prune_snapshots(retention_days):
+    snapshot_names = list_snapshot_names()
+    cutoff = time.time() - retention_days * 86400
+    for name in snapshot_names[:-1]:
+        path = os.path.join(SNAPSHOTS_DIR, f"{name}.json")
+        if os.path.getmtime(path) < cutoff:
+            os.remove(path)
+            print(f"Removed snapshot {name}")
+
+    referenced = set()
+    for name in list_snapshot_names():
+        for entry in load_snapshot(name)['databases'].values():
+            referenced.update(entry[kind]['object'] for kind in ('schema', 'triggers') if kind in entry)
+            referenced.update(table['object'] for table in entry['tables'].values())
+
+    removed = 0
+    for folder, _, files in os.walk(OBJECTS_DIR):
+        for file_name in files:
+            if file_name not in referenced and not file_name.startswith('tmp-'):
+                os.remove(os.path.join(folder, file_name))
+                removed += 1
+    if removed:
+        print(f"Removed {removed} unreferenced objects")
+
+# Function to print the saved snapshots
+def print_snapshots():
+    for name in list_snapshot_names():
+        databases = load_snapshot(name)['databases']
+        size = sum(table.get('bytes', 0) for entry in databases.values() for table in entry['tables'].values())
+        print(f"{name}: {len(databases)} databases, {size / (1024 * 1024):.1f} MB uncompressed")
+
+# Function to reassemble a snapshot into one SQL stream: per database the schema, then the table data,
+# then the triggers. The stream is loaded into the server, or written to a file when output is given
+def restore_snapshot(name, databases=None, output=None):
+    snapshot = load_snapshot(name)['databases']
+    databases = databases or list(snapshot)
+    unknown = [db for db in databases if db not in snapshot]
+    if unknown:
+        raise SystemExit(f"Databases not in snapshot {name}: {', '.join(unknown)}")
+
+    if output:
+        client = None
+        target = open(output, 'wb')
+    else:
+        client = subprocess.Popen(['mysql', '-h', backup_config.mysql_host, '-u', backup_config.mysql_user],
+                                  env=mysql_env(), stdin=subprocess.PIPE)
+        target = client.stdin
+
+    try:
+        for db in databases:
+            entry = snapshot[db]
+            if entry['failed']:
+                print(f"Warning: {db} is incomplete in this snapshot, missing {', '.join(entry['failed'])}")
+            print(f"Restoring {db} from snapshot {name}...")
+            quoted_db = db.replace('`', '``')
+            target.write(f"CREATE DATABASE IF NOT EXISTS `{quoted_db}`;\nUSE `{quoted_db}`;\n".encode('utf-8'))
+
+            parts = [entry.get('schema')] + list(entry['tables'].values()) + [entry.get('triggers')]
+            for part in parts:
+                if part is None:
+                    continue
+                extension = os.path.splitext(part['object'])[1]
+                target.flush()
+                subprocess.run(decompress_command(extension) + [object_path(part['object'])], stdout=target, check=True)
+    finally:
+        target.close()
+        if client and client.wait() != 0:
+            raise SystemExit(f"Restore of snapshot {name} failed (mysql exit {client.returncode}).")
+    print(f"Restored snapshot {name}" + (f" to {output}" if output else "") + ".")
+
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Back up MySQL databases in parallel with streaming compression.")
+    parser.add_argument("databases", nargs="*", help="Databases to back up (default: from backup_config, or all)")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of databases dumped at the same time (default: %(default)s)")
+    parser.add_argument("--codec", choices=CODECS.keys(), help="Compressor to use (default: zstd, else pigz, else gzip)")
+    parser.add_argument("--level", type=int, help="Compression level (default: 3 for zstd, 6 for pigz/gzip)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Dump only the tables changed since the last snapshot into the deduplicated object store "
+                             "(each table is dumped in its own session, so the snapshot is not consistent across tables)")
+    parser.add_argument("--retention-days", type=int, default=backup_config.retention_days,
+                        help="Delete backups and incremental snapshots older than this many days (default: %(default)s)")
+    parser.add_argument("--list-snapshots", action="store_true", help="List the incremental snapshots")
+    parser.add_argument("--restore", metavar="SNAPSHOT", help="Restore the databases of an incremental snapshot")
+    parser.add_argument("--output", help="With --restore, write the reassembled SQL to this file instead of loading it")
+    args = parser.parse_args()
+
+    if args.list_snapshots:
+        print_snapshots()
+    elif args.restore:
+        restore_snapshot(args.restore, args.databases, args.output)
+    else:
+        codec = select_codec(args.codec)
+        level = args.level if args.level is not None else CODECS[codec][2]
+        databases = args.databases or list_databases()
+
+        if args.incremental:
+            ok = run_incremental_backup(databases, args.jobs, codec, level)
+            prune_snapshots(args.retention_days)
+        else:
+            ok = run_backup(databases, args.jobs, codec, level)
+            prune_backups(args.retention_days)
+        if not ok:
+            raise SystemExit(1)
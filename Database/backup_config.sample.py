@@ -0,0 +1,17 @@
+# backup_config.sample.py
+mysql_host = "localhost"
+mysql_user = "<user>"
+mysql_password = "<password>"
+
+# Backups are written to <backup_dir>/<dd-mm-yyyy>/
+backup_dir = "/data/backup"
+
+# Databases to back up; None backs up every database except excluded_databases
+databases = None
+excluded_databases = ["information_schema", "performance_schema"]
+
+# Options passed to mysqldump for every database
+mysqldump_options = ["--force", "--opt"]
+
+# Backup folders and incremental snapshots older than this many days are deleted (the latest is always kept)
+retention_days = 5
@@ -1,150 +1,624 @@
-from sqlalchemy import create_engine, inspect, text
-from sqlalchemy.sql.sqltypes import Integer, String
+import argparse
+import gzip
+import json
+import os
+import re
+from concurrent.futures import ThreadPoolExecutor
+from sqlalchemy import create_engine, text, bindparam
 import compare_db_config
 
 # Create engine connections to both databases
 db1_engine = create_engine(compare_db_config.db1_url)
 db2_engine = create_engine(compare_db_config.db2_url)
 
-# Create inspectors for both databases
-db1_inspector = inspect(db1_engine)
-db2_inspector = inspect(db2_engine)
-
-# Function to normalize SQLAlchemy types to their base types
+# Number of primary key values covered by one checksum chunk on the first pass
+DATA_CHUNK_SIZE = 100000
+# Number of sub-chunks a mismatching chunk is split into on the next pass
+DATA_FANOUT = 16
+# Chunks covering at most this many key values are compared row by row
+DATA_LEAF_SIZE = 1000
+
+# Streams the comparison as it runs: readable lines to a text log and one JSON record per difference to a
+# JSON Lines file, both flushed line by line so downstream tools can consume results immediately
+class ComparisonLog:
+    def __init__(self, base_name, target=None):
+        self.text_path = f"{base_name}.txt"
+        self.jsonl_path = f"{base_name}.jsonl"
+        self.target = target
+        self.text_file = open(self.text_path, 'w', buffering=1)
+        self.jsonl_file = open(self.jsonl_path, 'w', buffering=1)
+
+    # Write a heading line to the text log
+    def section(self, title):
+        self.text_file.write(f"{title}\n")
+
+    # Write one difference to both outputs; details become fields of the JSON record
+    def difference(self, category, message, **details):
+        self.text_file.write(f"  {message}\n")
+        record = {'target': self.target, 'category': category, **details, 'message': message}
+        self.jsonl_file.write(json.dumps(record, default=json_value) + "\n")
+
+    def close(self):
+        self.text_file.close()
+        self.jsonl_file.close()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc_info):
+        self.close()
+
+# Function to convert values json can't serialize (sets, keys of any column type)
+def json_value(value):
+    if isinstance(value, (set, frozenset)):
+        return sorted(value, key=str)
+    return str(value)
+
+# Function to normalize MySQL column types (integer display widths are cosmetic and dropped in MySQL 8)
 def normalize_type(column_type):
-    # Check for common types like Integer, String, etc.
-    if isinstance(column_type, Integer):
-        return 'INTEGER'
-    elif isinstance(column_type, String):
-        # If it's a String, include the length in the comparison
-        return f'VARCHAR({column_type.length})'
-    else:
-        # Return the type's string representation for other types
-        return str(column_type)
-
-# Function to compare table structures and log the differences
-def compare_table_structure(db1_inspector, db2_inspector, table_name, log):
-    db1_columns = db1_inspector.get_columns(table_name)
-    db2_columns = db2_inspector.get_columns(table_name)
-
-    db1_column_map = {col['name']: col['type'] for col in db1_columns}
-    db2_column_map = {col['name']: col['type'] for col in db2_columns}
-
-    log.append(f"\nComparing table: {table_name}")
-    
-    # Columns only in DB1
-    only_in_db1 = set(db1_column_map.keys()) - set(db2_column_map.keys())
+    return re.sub(r'^((?:tiny|small|medium|big)?int)\(\d+\)', r'\1', column_type.lower())
+
+# Function to check whether a normalized column type is an integer type
+def is_integer_type(column_type):
+    return re.match(r'^(tiny|small|medium|big)?int\b', column_type) is not None
+
+# Function to build an information_schema query, optionally limited to some tables
+def schema_query(sql, table_names=None):
+    if table_names is None:
+        return text(sql.replace("{table_filter}", "")), {}
+    query = text(sql.replace("{table_filter}", " AND TABLE_NAME IN :table_names"))
+    return query.bindparams(bindparam('table_names', expanding=True)), {'table_names': list(table_names)}
+
+# Function to load the columns, indexes and keys of every table in the schema (or only of table_names) with a handful of information_schema queries
+def load_schema(engine, table_names=None):
+    schema = {}
+    with engine.connect() as conn:
+        tables = conn.execute(*schema_query(
+            "SELECT TABLE_NAME FROM information_schema.TABLES "
+            "WHERE TABLE_SCHEMA = DATABASE() AND TABLE_TYPE = 'BASE TABLE'{table_filter}", table_names
+        )).fetchall()
+        for (table_name,) in tables:
+            schema[table_name] = {'columns': {}, 'primary_key': [], 'indexes': {}, 'foreign_keys': {}}
+
+        columns = conn.execute(*schema_query(
+            "SELECT TABLE_NAME, COLUMN_NAME, COLUMN_TYPE FROM information_schema.COLUMNS "
+            "WHERE TABLE_SCHEMA = DATABASE(){table_filter} ORDER BY TABLE_NAME, ORDINAL_POSITION", table_names
+        )).fetchall()
+        for table_name, column_name, column_type in columns:
+            if table_name in schema:
+                schema[table_name]['columns'][column_name] = normalize_type(column_type)
+
+        # Index columns come back in order, so each index is built up one column at a time
+        index_columns = conn.execute(*schema_query(
+            "SELECT TABLE_NAME, INDEX_NAME, NON_UNIQUE, COLUMN_NAME FROM information_schema.STATISTICS "
+            "WHERE TABLE_SCHEMA = DATABASE(){table_filter} ORDER BY TABLE_NAME, INDEX_NAME, SEQ_IN_INDEX", table_names
+        )).fetchall()
+        for table_name, index_name, non_unique, column_name in index_columns:
+            if table_name not in schema:
+                continue
+            if index_name == 'PRIMARY':
+                schema[table_name]['primary_key'].append(column_name)
+            else:
+                index = schema[table_name]['indexes'].setdefault(index_name, {'unique': not non_unique, 'columns': []})
+                index['columns'].append(column_name)
+
+        key_columns = conn.execute(*schema_query(
+            "SELECT TABLE_NAME, CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME "
+            "FROM information_schema.KEY_COLUMN_USAGE "
+            "WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL{table_filter} "
+            "ORDER BY TABLE_NAME, CONSTRAINT_NAME, ORDINAL_POSITION", table_names
+        )).fetchall()
+        for table_name, constraint_name, column_name, referenced_table, referenced_column in key_columns:
+            if table_name not in schema:
+                continue
+            foreign_key = schema[table_name]['foreign_keys'].setdefault(
+                constraint_name, {'columns': [], 'referenced_table': referenced_table, 'referenced_columns': []}
+            )
+            foreign_key['columns'].append(column_name)
+            foreign_key['referenced_columns'].append(referenced_column)
+
+    return schema
+
+# Function to describe an index for the log
+def describe_index(index):
+    return f"{'UNIQUE ' if index['unique'] else ''}({', '.join(index['columns'])})"
+
+# Function to describe a foreign key for the log
+def describe_foreign_key(foreign_key):
+    return (f"({', '.join(foreign_key['columns'])}) REFERENCES "
+            f"{foreign_key['referenced_table']} ({', '.join(foreign_key['referenced_columns'])})")
+
+# Function to compare two maps of named objects (columns, indexes, keys), log the differences and return how many were found
+def compare_named_objects(kind, table_name, db1_map, db2_map, log):
+    category = kind.lower().replace(' ', '_')
+
+    # Objects only in DB1
+    only_in_db1 = set(db1_map.keys()) - set(db2_map.keys())
     if only_in_db1:
-        log.append(f"  Columns only in DB1: {only_in_db1}")
+        log.difference(category, f"{kind}s only in DB1: {only_in_db1}",
+                       change='only_in_db1', table=table_name, names=only_in_db1)
 
-    # Columns only in DB2
-    only_in_db2 = set(db2_column_map.keys()) - set(db1_column_map.keys())
+    # Objects only in DB2
+    only_in_db2 = set(db2_map.keys()) - set(db1_map.keys())
     if only_in_db2:
-        log.append(f"  Columns only in DB2: {only_in_db2}")
+        log.difference(category, f"{kind}s only in DB2: {only_in_db2}",
+                       change='only_in_db2', table=table_name, names=only_in_db2)
+
+    # Objects in both DBs but with a different definition
+    different = [name for name in db1_map.keys() & db2_map.keys() if db1_map[name] != db2_map[name]]
+    for name in different:
+        log.difference(category, f"{kind} difference in '{name}': DB1 ({db1_map[name]}) vs DB2 ({db2_map[name]})",
+                       change='different', table=table_name, name=name, db1=db1_map[name], db2=db2_map[name])
+
+    return len(only_in_db1) + len(only_in_db2) + len(different)
+
+# Function to compare table structures, log the differences and return how many were found
+def compare_table_structure(db1_table, db2_table, table_name, log):
+    log.section(f"\nComparing table: {table_name}")
+
+    differences = compare_named_objects("Column", table_name, db1_table['columns'], db2_table['columns'], log)
+
+    if db1_table['primary_key'] != db2_table['primary_key']:
+        log.difference('primary_key', f"Primary key difference: DB1 ({db1_table['primary_key']}) vs DB2 ({db2_table['primary_key']})",
+                       change='different', table=table_name, db1=db1_table['primary_key'], db2=db2_table['primary_key'])
+        differences += 1
+
+    differences += compare_named_objects(
+        "Index",
+        table_name,
+        {name: describe_index(index) for name, index in db1_table['indexes'].items()},
+        {name: describe_index(index) for name, index in db2_table['indexes'].items()},
+        log
+    )
+    differences += compare_named_objects(
+        "Foreign key",
+        table_name,
+        {name: describe_foreign_key(fk) for name, fk in db1_table['foreign_keys'].items()},
+        {name: describe_foreign_key(fk) for name, fk in db2_table['foreign_keys'].items()},
+        log
+    )
+    return differences
+
+# Function to normalize a view or procedure definition so only meaningful changes are reported
+def normalize_definition(definition, schema_name):
+    definition = definition or ''
+    # Drop the definer account, which differs between servers without changing behaviour
+    definition = re.sub(r"DEFINER\s*=\s*(`[^`]*`|'[^']*'|\S+?)@(`[^`]*`|'[^']*'|\S+)\s*", '', definition, flags=re.IGNORECASE)
+    # information_schema qualifies objects with the schema name, which differs between environments
+    definition = definition.replace(f"`{schema_name}`.", '')
+    definition = re.sub(r'AUTO_INCREMENT\s*=\s*\d+\s*', '', definition, flags=re.IGNORECASE)
+    return ' '.join(definition.split())
+
+# Function to fetch the definition of every view in one query, keyed by view name
+def fetch_views(engine):
+    with engine.connect() as conn:
+        views = conn.execute(text(
+            "SELECT TABLE_SCHEMA, TABLE_NAME, VIEW_DEFINITION FROM information_schema.VIEWS "
+            "WHERE TABLE_SCHEMA = DATABASE()"
+        )).fetchall()
+    return {view_name: normalize_definition(definition, schema_name) for schema_name, view_name, definition in views}
+
+# Function to fetch the parameters and body of every stored procedure in two queries, keyed by procedure name
+def fetch_stored_procedures(engine):
+    with engine.connect() as conn:
+        sps = conn.execute(text(
+            "SELECT ROUTINE_SCHEMA, ROUTINE_NAME, ROUTINE_DEFINITION FROM information_schema.ROUTINES "
+            "WHERE ROUTINE_SCHEMA = DATABASE() AND ROUTINE_TYPE = 'PROCEDURE'"
+        )).fetchall()
+        parameters = conn.execute(text(
+            "SELECT SPECIFIC_NAME, PARAMETER_MODE, PARAMETER_NAME, DTD_IDENTIFIER FROM information_schema.PARAMETERS "
+            "WHERE SPECIFIC_SCHEMA = DATABASE() AND ROUTINE_TYPE = 'PROCEDURE' ORDER BY SPECIFIC_NAME, ORDINAL_POSITION"
+        )).fetchall()
+
+    signatures = {}
+    for sp_name, mode, parameter_name, data_type in parameters:
+        signatures.setdefault(sp_name, []).append(f"{mode} {parameter_name} {data_type}")
+
+    return {
+        sp_name: f"({', '.join(signatures.get(sp_name, []))}) {normalize_definition(definition, schema_name)}"
+        for schema_name, sp_name, definition in sps
+    }
+
+# Function to compare views, log the differences and return how many were found
+def compare_views(db1_views, db2_views, log):
+    db1_view_names = set(db1_views.keys())
+    db2_view_names = set(db2_views.keys())
+
+    log.section("\nComparing views:")
+
+    # Views only in DB1
+    only_in_db1 = db1_view_names - db2_view_names
+    if only_in_db1:
+        log.difference('view', f"Views only in DB1: {only_in_db1}", change='only_in_db1', names=only_in_db1)
 
-    # Columns with different types
-    for col in db1_column_map.keys() & db2_column_map.keys():
-        db1_col_type = normalize_type(db1_column_map[col])
-        db2_col_type = normalize_type(db2_column_map[col])
-        if db1_col_type != db2_col_type:
-            log.append(f"  Column type difference in '{col}': DB1 ({db1_col_type}) vs DB2 ({db2_col_type})")
+    # Views only in DB2
+    only_in_db2 = db2_view_names - db1_view_names
+    if only_in_db2:
+        log.difference('view', f"Views only in DB2: {only_in_db2}", change='only_in_db2', names=only_in_db2)
 
-# Function to compare views and log the differences
-def compare_views(db1_engine, db2_engine, log):
-    with db1_engine.connect() as db1_conn, db2_engine.connect() as db2_conn:
-        db1_views = db1_conn.execute(text("SHOW FULL TABLES WHERE Table_type = 'VIEW'")).fetchall()
-        db2_views = db2_conn.execute(text("SHOW FULL TABLES WHERE Table_type = 'VIEW'")).fetchall()
+    # Views in both DBs but different definitions
+    different = [view_name for view_name in db1_view_names & db2_view_names if db1_views[view_name] != db2_views[view_name]]
+    for view_name in different:
+        log.difference('view', f"Difference in view definition for '{view_name}'.", change='different', name=view_name)
 
-        db1_view_names = {view[0] for view in db1_views}
-        db2_view_names = {view[0] for view in db2_views}
+    return len(only_in_db1) + len(only_in_db2) + len(different)
 
-        log.append("\nComparing views:")
+# Function to compare stored procedures, log the differences and return how many were found
+def compare_stored_procedures(db1_sps, db2_sps, log):
+    db1_sp_names = set(db1_sps.keys())
+    db2_sp_names = set(db2_sps.keys())
 
-        # Views only in DB1
-        only_in_db1 = db1_view_names - db2_view_names
-        if only_in_db1:
-            log.append(f"  Views only in DB1: {only_in_db1}")
+    log.section("\nComparing stored procedures:")
 
-        # Views only in DB2
-        only_in_db2 = db2_view_names - db1_view_names
-        if only_in_db2:
-            log.append(f"  Views only in DB2: {only_in_db2}")
+    # Stored procedures only in DB1
+    only_in_db1 = db1_sp_names - db2_sp_names
+    if only_in_db1:
+        log.difference('procedure', f"Stored procedures only in DB1: {only_in_db1}", change='only_in_db1', names=only_in_db1)
 
-        # Views in both DBs but different definitions
-        for view_name in db1_view_names & db2_view_names:
-            db1_view_sql = db1_conn.execute(text(f"SHOW CREATE VIEW {view_name}")).fetchone()[1]
-            db2_view_sql = db2_conn.execute(text(f"SHOW CREATE VIEW {view_name}")).fetchone()[1]
-            if db1_view_sql != db2_view_sql:
-                log.append(f"  Difference in view definition for '{view_name}'.")
+    # Stored procedures only in DB2
+    only_in_db2 = db2_sp_names - db1_sp_names
+    if only_in_db2:
+        log.difference('procedure', f"Stored procedures only in DB2: {only_in_db2}", change='only_in_db2', names=only_in_db2)
+
+    # Stored procedures in both DBs but different definitions
+    different = [sp_name for sp_name in db1_sp_names & db2_sp_names if db1_sps[sp_name] != db2_sps[sp_name]]
+    for sp_name in different:
+        log.difference('procedure', f"Difference in stored procedure definition for '{sp_name}'.",
+                       change='different', name=sp_name)
+
+    return len(only_in_db1) + len(only_in_db2) + len(different)
+
+# Function to fetch a fingerprint of the definition of every table: MD5 hashes of its columns, indexes and
+# foreign keys, each read with one grouped information_schema query. Timestamps are not used, as INSTANT/INPLACE
+# ALTERs keep CREATE_TIME and UPDATE_TIME tracks (cached) data changes. The server reads the same rows as
+# load_schema, so the fingerprints only save sending those rows over the network; --offline avoids DB1 altogether
+def fetch_table_fingerprints(engine):
+    parts = [
+        """
+        SELECT c.TABLE_NAME, MD5(GROUP_CONCAT(
+            CONCAT_WS(':', c.COLUMN_NAME, c.COLUMN_TYPE, c.IS_NULLABLE, IFNULL(c.COLUMN_DEFAULT, 'NULL'), c.EXTRA)
+            ORDER BY c.ORDINAL_POSITION SEPARATOR ','))
+        FROM information_schema.COLUMNS c
+        JOIN information_schema.TABLES t ON t.TABLE_SCHEMA = c.TABLE_SCHEMA AND t.TABLE_NAME = c.TABLE_NAME
+        WHERE c.TABLE_SCHEMA = DATABASE() AND t.TABLE_TYPE = 'BASE TABLE'
+        GROUP BY c.TABLE_NAME
+        """,
+        """
+        SELECT TABLE_NAME, MD5(GROUP_CONCAT(
+            CONCAT_WS(':', INDEX_NAME, NON_UNIQUE, SEQ_IN_INDEX, COLUMN_NAME)
+            ORDER BY INDEX_NAME, SEQ_IN_INDEX SEPARATOR ','))
+        FROM information_schema.STATISTICS
+        WHERE TABLE_SCHEMA = DATABASE()
+        GROUP BY TABLE_NAME
+        """,
+        """
+        SELECT TABLE_NAME, MD5(GROUP_CONCAT(
+            CONCAT_WS(':', CONSTRAINT_NAME, COLUMN_NAME, REFERENCED_TABLE_NAME, REFERENCED_COLUMN_NAME)
+            ORDER BY CONSTRAINT_NAME, ORDINAL_POSITION SEPARATOR ','))
+        FROM information_schema.KEY_COLUMN_USAGE
+        WHERE TABLE_SCHEMA = DATABASE() AND REFERENCED_TABLE_NAME IS NOT NULL
+        GROUP BY TABLE_NAME
+        """,
+    ]
+    with engine.connect() as conn:
+        # GROUP_CONCAT silently truncates at 1024 bytes by default
+        conn.execute(text("SET SESSION group_concat_max_len = 1073741824"))
+        columns, indexes, foreign_keys = (dict(conn.execute(text(sql)).fetchall()) for sql in parts)
+    return {
+        table_name: f"{column_hash}|{indexes.get(table_name, '')}|{foreign_keys.get(table_name, '')}"
+        for table_name, column_hash in columns.items()
+    }
+
+# Function to read a schema snapshot file
+def load_snapshot(path):
+    with gzip.open(path, 'rt') as f:
+        return json.load(f)
+
+# Function to write a schema snapshot file
+def save_snapshot(path, snapshot):
+    with gzip.open(path, 'wt') as f:
+        json.dump(snapshot, f)
+
+# Function to bring a schema snapshot up to date, re-reflecting only the tables whose fingerprint changed
+def refresh_snapshot(engine, path):
+    snapshot = load_snapshot(path) if os.path.exists(path) else {'fingerprints': {}, 'tables': {}}
+    fingerprints = fetch_table_fingerprints(engine)
+
+    changed_tables = [
+        table_name for table_name, fingerprint in fingerprints.items()
+        if snapshot['fingerprints'].get(table_name) != fingerprint or table_name not in snapshot['tables']
+    ]
+    tables = {table_name: snapshot['tables'][table_name] for table_name in fingerprints if table_name not in changed_tables}
+    if changed_tables:
+        tables.update(load_schema(engine, changed_tables))
+
+    # Views and procedures are a single cheap query each, so they are always fetched again
+    snapshot = {
+        'fingerprints': fingerprints,
+        'tables': tables,
+        'views': fetch_views(engine),
+        'procedures': fetch_stored_procedures(engine),
+    }
+    save_snapshot(path, snapshot)
+    print(f"Snapshot {path} updated: {len(changed_tables)} of {len(fingerprints)} tables re-reflected")
+    return snapshot
+
+# Function to introspect one database, running the table, view and procedure queries concurrently
+def introspect_database(engine):
+    categories = (('tables', load_schema), ('views', fetch_views), ('procedures', fetch_stored_procedures))
+    with ThreadPoolExecutor(max_workers=len(categories)) as executor:
+        futures = {category: executor.submit(fetch, engine) for category, fetch in categories}
+        return {category: future.result() for category, future in futures.items()}
+
+# Function to introspect the reference database (DB1), reading it from a snapshot file when one is given
+# (refreshed first unless offline)
+def introspect_reference(snapshot_path=None, offline=False):
+    if snapshot_path is None:
+        return introspect_database(db1_engine)
+    if offline:
+        return load_snapshot(snapshot_path)
+    return refresh_snapshot(db1_engine, snapshot_path)
+
+# Function to build the SQL expression hashing one row (NULL and '' hash differently)
+def row_hash_sql(conn, columns):
+    quote = conn.dialect.identifier_preparer.quote
+    quoted_columns = [quote(col) for col in columns]
+    null_flags = ", ".join(f"ISNULL({col})" for col in quoted_columns)
+    return f"MD5(CONCAT_WS('#', {', '.join(quoted_columns)}, CONCAT({null_flags})))"
+
+# Function to build the SQL expression turning the row hash into an integer that BIT_XOR can aggregate
+def row_checksum_sql(conn, columns):
+    return f"CAST(CONV(LEFT({row_hash_sql(conn, columns)}, 16), 16, 10) AS UNSIGNED)"
+
+# Function to checksum every chunk of a primary key range in a single query, keyed by chunk number
+def chunk_checksums(conn, table_name, pk_name, columns, low, high, width):
+    quote = conn.dialect.identifier_preparer.quote
+    pk = quote(pk_name)
+    row_checksum = row_checksum_sql(conn, columns)
+    query = text(
+        f"SELECT FLOOR(({pk} - :low) / :width) AS chunk, COUNT(*), BIT_XOR({row_checksum}) "
+        f"FROM {quote(table_name)} WHERE {pk} BETWEEN :low AND :high GROUP BY chunk"
+    )
+    rows = conn.execute(query, {'low': low, 'high': high, 'width': width}).fetchall()
+    return {int(chunk): (count, checksum) for chunk, count, checksum in rows}
+
+# Function to fetch the hash of every row in a small primary key range
+def row_hashes(conn, table_name, pk_name, columns, low, high):
+    quote = conn.dialect.identifier_preparer.quote
+    pk = quote(pk_name)
+    query = text(
+        f"SELECT {pk}, {row_hash_sql(conn, columns)} FROM {quote(table_name)} "
+        f"WHERE {pk} BETWEEN :low AND :high"
+    )
+    return dict(conn.execute(query, {'low': low, 'high': high}).fetchall())
+
+# Function to locate the differing keys of a primary key range, only descending into chunks whose checksums differ.
+# Differences are logged as soon as each small range is resolved; returns the number of differing rows.
+def diff_pk_range(db1_conn, db2_conn, table_name, pk_name, columns, low, high, log, width=None):
+    if high - low + 1 <= DATA_LEAF_SIZE:
+        db1_rows = row_hashes(db1_conn, table_name, pk_name, columns, low, high)
+        db2_rows = row_hashes(db2_conn, table_name, pk_name, columns, low, high)
+        diffs = {
+            'only_in_db1': (f"Rows only in DB1 for table '{table_name}'", sorted(db1_rows.keys() - db2_rows.keys())),
+            'only_in_db2': (f"Rows only in DB2 for table '{table_name}'", sorted(db2_rows.keys() - db1_rows.keys())),
+            'different': (f"Rows with different data in table '{table_name}'",
+                          sorted(pk for pk in db1_rows.keys() & db2_rows.keys() if db1_rows[pk] != db2_rows[pk])),
+        }
+        for change, (description, keys) in diffs.items():
+            if keys:
+                log.difference('data', f"{description} ({pk_name}): {keys}",
+                               change=change, table=table_name, key_column=pk_name, keys=keys)
+        return sum(len(keys) for description, keys in diffs.values())
+
+    if width is None:
+        width = -(-(high - low + 1) // DATA_FANOUT)
+
+    db1_chunks = chunk_checksums(db1_conn, table_name, pk_name, columns, low, high, width)
+    db2_chunks = chunk_checksums(db2_conn, table_name, pk_name, columns, low, high, width)
+
+    differences = 0
+    for chunk in sorted(db1_chunks.keys() | db2_chunks.keys()):
+        if db1_chunks.get(chunk) != db2_chunks.get(chunk):
+            chunk_low = low + chunk * width
+            chunk_high = min(chunk_low + width - 1, high)
+            differences += diff_pk_range(db1_conn, db2_conn, table_name, pk_name, columns, chunk_low, chunk_high, log)
+    return differences
+
+# Function to tell why the data of a table can't be compared between the two databases, or None when it can
+def data_comparison_problem(db1_table, db2_table, columns):
+    if not columns:
+        return "no columns in common"
+    pk_columns = db1_table['primary_key']
+    if len(pk_columns) == 1 and is_integer_type(db1_table['columns'][pk_columns[0]]):
+        db2_type = db2_table['columns'].get(pk_columns[0])
+        if db2_type is None:
+            return f"primary key column '{pk_columns[0]}' is missing in DB2"
+        if not is_integer_type(db2_type):
+            return f"primary key column '{pk_columns[0]}' is not an integer in DB2"
+    return None
+
+# Function to log a table whose data was not compared
+def log_skipped_data(log, table_name, reason):
+    log.difference('data', f"Data of table '{table_name}' not compared: {reason}.",
+                   change='skipped', table=table_name, reason=reason)
+
+# Function to compare the data of a table, log the keys of the rows that differ and return how many rows differ.
+# A table that can't be compared is logged as skipped and counted as one difference
+def compare_table_data(db1_engine, db2_engine, db1_table, db2_table, table_name, log):
+    columns = [col for col in db1_table['columns'] if col in db2_table['columns']]
+    pk_columns = db1_table['primary_key']
+    problem = data_comparison_problem(db1_table, db2_table, columns)
+    if problem:
+        log_skipped_data(log, table_name, problem)
+        return 1
 
-# Function to compare stored procedures and log the differences
-def compare_stored_procedures(db1_engine, db2_engine, log):
     with db1_engine.connect() as db1_conn, db2_engine.connect() as db2_conn:
-        db1_sps = db1_conn.execute(text("SHOW PROCEDURE STATUS WHERE Db = DATABASE()")).fetchall()
-        db2_sps = db2_conn.execute(text("SHOW PROCEDURE STATUS WHERE Db = DATABASE()")).fetchall()
-
-        db1_sp_names = {sp[1] for sp in db1_sps}
-        db2_sp_names = {sp[1] for sp in db2_sps}
-
-        log.append("\nComparing stored procedures:")
-
-        # Stored procedures only in DB1
-        only_in_db1 = db1_sp_names - db2_sp_names
-        if only_in_db1:
-            log.append(f"  Stored procedures only in DB1: {only_in_db1}")
-
-        # Stored procedures only in DB2
-        only_in_db2 = db2_sp_names - db1_sp_names
-        if only_in_db2:
-            log.append(f"  Stored procedures only in DB2: {only_in_db2}")
-
-        # Stored procedures in both DBs but different definitions
-        for sp_name in db1_sp_names & db2_sp_names:
-            db1_sp_sql = db1_conn.execute(text(f"SHOW CREATE PROCEDURE {sp_name}")).fetchone()[2]
-            db2_sp_sql = db2_conn.execute(text(f"SHOW CREATE PROCEDURE {sp_name}")).fetchone()[2]
-            if db1_sp_sql != db2_sp_sql:
-                log.append(f"  Difference in stored procedure definition for '{sp_name}'.")
-
-# Function to compare tables, views, and stored procedures and log differences
-def generate_comparison_log():
-    log = []
-
-    # Get table names from both databases
-    db1_tables = set(db1_inspector.get_table_names())
-    db2_tables = set(db2_inspector.get_table_names())
-
-    log.append("Comparing tables:")
+        quote = db1_conn.dialect.identifier_preparer.quote
+
+        # Without a single integer key the rows can't be split into ranges, so compare one checksum for the table
+        if len(pk_columns) != 1 or not is_integer_type(db1_table['columns'][pk_columns[0]]):
+            row_checksum = row_checksum_sql(db1_conn, columns)
+            query = text(f"SELECT COUNT(*), BIT_XOR({row_checksum}) FROM {quote(table_name)}")
+            if db1_conn.execute(query).fetchone() != db2_conn.execute(query).fetchone():
+                log.difference('data', f"Data differs in table '{table_name}' (no single integer primary key to locate rows).",
+                               change='different', table=table_name)
+                return 1
+            return 0
+
+        pk_name = pk_columns[0]
+        bounds_query = text(f"SELECT MIN({quote(pk_name)}), MAX({quote(pk_name)}) FROM {quote(table_name)}")
+        bounds = [db1_conn.execute(bounds_query).fetchone(), db2_conn.execute(bounds_query).fetchone()]
+        lows = [low for low, high in bounds if low is not None]
+        highs = [high for low, high in bounds if high is not None]
+        if not lows:
+            return 0
+
+        return diff_pk_range(db1_conn, db2_conn, table_name, pk_name, columns, min(lows), max(highs), log, DATA_CHUNK_SIZE)
+
+# Function to compare the introspected tables, views, and stored procedures of two databases, log the differences
+# and return the number of differences per category
+def compare_schemas(db1_metadata, db2_metadata, db2_engine, log, compare_data=False):
+    db1_schema = db1_metadata['tables']
+    db2_schema = db2_metadata['tables']
+
+    db1_tables = set(db1_schema.keys())
+    db2_tables = set(db2_schema.keys())
+    counts = {}
+
+    log.section("Comparing tables:")
 
     # Tables only in DB1
     only_in_db1 = db1_tables - db2_tables
     if only_in_db1:
-        log.append(f"  Tables only in DB1: {only_in_db1}")
+        log.difference('table', f"Tables only in DB1: {only_in_db1}", change='only_in_db1', names=only_in_db1)
 
     # Tables only in DB2
     only_in_db2 = db2_tables - db1_tables
     if only_in_db2:
-        log.append(f"  Tables only in DB2: {only_in_db2}")
+        log.difference('table', f"Tables only in DB2: {only_in_db2}", change='only_in_db2', names=only_in_db2)
+    counts['tables'] = len(only_in_db1) + len(only_in_db2)
 
     # Compare structure for tables that exist in both databases
-    for table_name in db1_tables & db2_tables:
-        compare_table_structure(db1_inspector, db2_inspector, table_name, log)
+    counts['structure'] = sum(
+        compare_table_structure(db1_schema[table_name], db2_schema[table_name], table_name, log)
+        for table_name in db1_tables & db2_tables
+    )
 
     # Compare views
-    compare_views(db1_engine, db2_engine, log)
+    counts['views'] = compare_views(db1_metadata['views'], db2_metadata['views'], log)
 
     # Compare stored procedures
-    compare_stored_procedures(db1_engine, db2_engine, log)
-
-    return log
-
-# Write the comparison log to a file
-def write_comparison_log():
-    log = generate_comparison_log()
-    
-    with open('db_comparison_log.txt', 'w') as f:
-        f.write("\n".join(log))
-
-    print("Comparison log generated: db_comparison_log.txt")
+    counts['procedures'] = compare_stored_procedures(db1_metadata['procedures'], db2_metadata['procedures'], log)
+
+    # Compare the contents of tables that exist in both databases
+    if compare_data:
+        log.section("\nComparing table data:")
+        counts['data'] = 0
+        for table_name in sorted(db1_tables & db2_tables):
+            # A table failing to compare is logged and the comparison goes on with the next one
+            try:
+                counts['data'] += compare_table_data(db1_engine, db2_engine, db1_schema[table_name],
+                                                     db2_schema[table_name], table_name, log)
+            except Exception as e:
+                log_skipped_data(log, table_name, f"comparison failed ({str(e).splitlines()[0]})")
+                counts['data'] += 1
+
+    return counts
+
+# Function to compare tables, views, and stored procedures and stream the differences to the log
+def generate_comparison_log(log, compare_data=False, snapshot_path=None, offline=False):
+    # Reflect tables, views and procedures of both databases at the same time
+    with ThreadPoolExecutor(max_workers=2) as executor:
+        db1_future = executor.submit(introspect_reference, snapshot_path, offline)
+        db2_future = executor.submit(introspect_database, db2_engine)
+        db1_metadata = db1_future.result()
+        db2_metadata = db2_future.result()
+
+    return compare_schemas(db1_metadata, db2_metadata, db2_engine, log, compare_data)
+
+# Write the comparison log to a text file and a JSON Lines file as the comparison runs
+def write_comparison_log(compare_data=False, snapshot_path=None, offline=False):
+    with ComparisonLog('db_comparison_log') as log:
+        generate_comparison_log(log, compare_data, snapshot_path, offline)
+
+    print(f"Comparison log generated: {log.text_path} ({log.jsonl_path})")
+
+# Function to compare the reference against one target database and write the target's own log file
+def compare_target(target_name, target_url, reference_metadata, compare_data=False):
+    target_engine = create_engine(target_url)
+    try:
+        with ComparisonLog(f"db_comparison_log_{target_name}", target=target_name) as log:
+            log.section(f"Reference (DB1) vs {target_name} (DB2)\n")
+            counts = compare_schemas(reference_metadata, introspect_database(target_engine), target_engine, log, compare_data)
+    finally:
+        target_engine.dispose()
+
+    print(f"Comparison log generated: {log.text_path} ({log.jsonl_path})")
+    return counts
+
+# Function to write the summary matrix of a fan-out comparison, one row per target
+def write_summary_matrix(results, compare_data=False):
+    categories = ['tables', 'structure', 'views', 'procedures'] + (['data'] if compare_data else [])
+    name_width = max([len('Target')] + [len(target_name) for target_name in results])
+
+    lines = [f"{'Target':<{name_width}}  " + "  ".join(f"{category.capitalize():>10}" for category in categories) + "  Status"]
+    for target_name, counts in results.items():
+        if isinstance(counts, Exception):
+            cells = "  ".join(f"{'-':>10}" for category in categories)
+            status = f"error: {counts}"
+        else:
+            cells = "  ".join(f"{counts[category]:>10}" for category in categories)
+            status = "differs" if any(counts.values()) else "identical"
+        lines.append(f"{target_name:<{name_width}}  {cells}  {status}")
+
+    with open('db_comparison_summary.txt', 'w') as f:
+        f.write("\n".join(lines))
+
+    print("\n".join(lines))
+    print("Comparison summary generated: db_comparison_summary.txt")
+
+# Compare the reference once against every database in compare_db_config.target_urls
+def write_fan_out_comparison(compare_data=False, snapshot_path=None, offline=False, workers=4):
+    reference_metadata = introspect_reference(snapshot_path, offline)
+
+    results = {}
+    with ThreadPoolExecutor(max_workers=workers) as executor:
+        futures = {
+            target_name: executor.submit(compare_target, target_name, target_url, reference_metadata, compare_data)
+            for target_name, target_url in compare_db_config.target_urls.items()
+        }
+        for target_name, future in futures.items():
+            try:
+                results[target_name] = future.result()
+            except Exception as e:
+                print(f"Failed to compare target {target_name}: {e}")
+                results[target_name] = e
+
+    write_summary_matrix(results, compare_data)
 
 # Run the log generation
-write_comparison_log()
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Compare the tables, views and stored procedures of db1 and db2.")
+    parser.add_argument("--data", action="store_true",
+                        help="Also compare table contents using chunked checksums computed on the database servers")
+    parser.add_argument("--snapshot", metavar="PATH",
+                        help="Read DB1's schema from this snapshot file, re-reflecting only tables that changed since it was saved. "
+                             "Finding the changed tables still reads DB1's whole information_schema, so this only saves "
+                             "network transfer; add --offline to not query DB1 at all")
+    parser.add_argument("--offline", action="store_true",
+                        help="Use the --snapshot file as-is without connecting to DB1")
+    parser.add_argument("--targets", action="store_true",
+                        help="Compare DB1 against every database in compare_db_config.target_urls instead of db2_url")
+    parser.add_argument("--workers", type=int, default=4,
+                        help="Number of targets compared concurrently with --targets (default: %(default)s)")
+    args = parser.parse_args()
+    if args.offline and not args.snapshot:
+        parser.error("--offline requires --snapshot")
+    if args.offline and args.data:
+        parser.error("--data needs a connection to DB1 and can't be used with --offline")
+
+    if args.targets:
+        write_fan_out_comparison(compare_data=args.data, snapshot_path=args.snapshot, offline=args.offline,
+                                 workers=args.workers)
+    else:
+        write_comparison_log(compare_data=args.data, snapshot_path=args.snapshot, offline=args.offline)
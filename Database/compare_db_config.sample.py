@@ -1,3 +1,11 @@
 # compare_db_config.sample.py
 db1_url = "mysql+pymysql://<user>:<password>@localhost/db1"
-db2_url = "mysql+pymysql://<user>:<password>@localhost/db2"
\ No newline at end of file
+db2_url = "mysql+pymysql://<user>:<password>@localhost/db2"
+# For transfer_table.py --bulk-load into MySQL, allow LOAD DATA LOCAL INFILE with:
+# db2_url = "mysql+pymysql://<user>:<password>@localhost/db2?local_infile=1"
+
+# Optional: databases compared against db1 by compare_db.py --targets
+target_urls = {
+    "tenant1": "mysql+pymysql://<user>:<password>@localhost/tenant1",
+    "tenant2": "mysql+pymysql://<user>:<password>@localhost/tenant2",
+}
@@ -0,0 +1,63 @@
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# compare_db creates engines for the databases in compare_db_config on import, use in-memory SQLite instead
+compare_db_config = types.ModuleType('compare_db_config')
+compare_db_config.db1_url = compare_db_config.db2_url = 'sqlite://'
+sys.modules.setdefault('compare_db_config', compare_db_config)
+
+import compare_db
+
+
+def table(columns, primary_key):
+    return {'columns': columns, 'primary_key': primary_key, 'indexes': {}, 'foreign_keys': {}}
+
+
+class RecordingLog:
+    def __init__(self):
+        self.records = []
+
+    def difference(self, category, message, **details):
+        self.records.append(dict(details, category=category, message=message))
+
+
+class DataComparisonProblemTest(unittest.TestCase):
+    def test_comparable_tables(self):
+        db1_table = table({'id': 'int', 'name': 'varchar(20)'}, ['id'])
+        self.assertIsNone(compare_db.data_comparison_problem(db1_table, db1_table, ['id', 'name']))
+
+    def test_tables_without_an_integer_key_are_checksummed_whole(self):
+        db1_table = table({'code': 'varchar(10)', 'name': 'varchar(20)'}, ['code'])
+        db2_table = table({'name': 'varchar(20)'}, [])
+        self.assertIsNone(compare_db.data_comparison_problem(db1_table, db2_table, ['name']))
+
+    def test_no_shared_columns(self):
+        self.assertEqual(compare_db.data_comparison_problem(table({'a': 'int'}, []), table({'b': 'int'}, []), []),
+                         "no columns in common")
+
+    def test_key_column_missing_or_not_integer_in_db2(self):
+        db1_table = table({'id': 'int', 'name': 'varchar(20)'}, ['id'])
+        renamed = table({'user_id': 'int', 'name': 'varchar(20)'}, ['user_id'])
+        retyped = table({'id': 'varchar(36)', 'name': 'varchar(20)'}, ['id'])
+        self.assertIn("missing in DB2", compare_db.data_comparison_problem(db1_table, renamed, ['name']))
+        self.assertIn("not an integer in DB2", compare_db.data_comparison_problem(db1_table, retyped, ['id', 'name']))
+
+
+class CompareTableDataTest(unittest.TestCase):
+    def test_skipped_table_is_logged(self):
+        log = RecordingLog()
+        db1_table = table({'id': 'int'}, ['id'])
+        db2_table = table({'user_id': 'int'}, ['user_id'])
+        differences = compare_db.compare_table_data(compare_db.db1_engine, compare_db.db2_engine,
+                                                    db1_table, db2_table, 'users', log)
+        self.assertEqual(differences, 1)
+        self.assertEqual([(record['category'], record['change'], record['table']) for record in log.records],
+                         [('data', 'skipped', 'users')])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,21 @@
+import shutil
+
+# Compressors in order of preference: zstd and pigz use every core given to them, gzip is the single-threaded fallback.
+# Each entry is (command builder taking the level and thread count, file extension, default level)
+CODECS = {
+    'zstd': (lambda level, threads: ['zstd', f'-{level}', f'-T{threads}', '-q', '-c'], '.zst', 3),
+    'pigz': (lambda level, threads: ['pigz', f'-{level}', '-p', str(threads), '-c'], '.gz', 6),
+    'gzip': (lambda level, threads: ['gzip', f'-{level}', '-c'], '.gz', 6),
+}
+
+# Decompressors by file extension, using only the tools every server with the codec has
+DECOMPRESSORS = {
+    '.zst': ['zstd', '-d', '-q', '-c'],
+    '.gz': ['gzip', '-d', '-c'],
+}
+
+# Function to get the local decompress command for a file extension, using pigz for gzip data when installed
+def decompress_command(extension):
+    if extension == '.gz' and shutil.which('pigz'):
+        return ['pigz', '-d', '-c']
+    return DECOMPRESSORS[extension]
@@ -0,0 +1,18 @@
+def order_levels(dependencies):
+    """
+    Group names into levels so that every name comes after the names it depends on, given
+    {name: names it depends on}. Names within one level are independent of each other.
+    """
+    remaining = {name: set(deps) & set(dependencies) - {name} for name, deps in dependencies.items()}
+    levels = []
+    while remaining:
+        level = [name for name, deps in remaining.items() if not deps]
+        if not level:
+            # Circular dependencies can't be ordered, so the rest go together and their failures are reported
+            level = list(remaining)
+        levels.append(level)
+        for name in level:
+            del remaining[name]
+        for deps in remaining.values():
+            deps.difference_update(level)
+    return levels
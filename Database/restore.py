@@ -0,0 +1,287 @@
+import argparse
+import backup_config
+import os
+import re
+import shutil
+import subprocess
+import tempfile
+import time
+from compression import DECOMPRESSORS, decompress_command
+from concurrent.futures import ThreadPoolExecutor
+
+# INSERT statements for the same table are merged into statements of up to this many bytes
+DEFAULT_BATCH_BYTES = 4 * 1024 * 1024
+
+# Section markers written by mysqldump
+TABLE_STRUCTURE_MARKER = re.compile(rb'^-- Table structure for table `(.+)`')
+TABLE_DATA_MARKER = re.compile(rb'^-- Dumping data for table `(.+)`')
+VIEW_PLACEHOLDER_MARKER = re.compile(rb'^-- Temporary (?:view|table) structure for view')
+POST_DATA_MARKER = re.compile(rb'^-- (?:Final view structure for view|Dumping routines for database|Dumping events for database)')
+DATABASE_MARKER = re.compile(rb'^-- Current Database: `(.+)`')
+
+# Row statements of a table's data section, and the statements around them that are dropped because
+# each table loads in its own session
+DATA_STATEMENT = re.compile(rb'^(?:INSERT (?:IGNORE )?INTO|REPLACE INTO) ')
+DATA_WRAPPER = re.compile(rb'^(?:LOCK TABLES |UNLOCK TABLES|/\*!40000 ALTER TABLE .* (?:DISABLE|ENABLE) KEYS \*/|set autocommit=0;|commit;)')
+
+# Statements that only follow a section marker; seeing one in the header means the dump has no markers
+TABLE_STATEMENT = re.compile(rb'^(?:CREATE TABLE|DROP TABLE|INSERT|REPLACE|DELIMITER)')
+
+# Index definitions in CREATE TABLE that are built after the data is loaded
+SECONDARY_KEY = re.compile(rb'^(?:UNIQUE |FULLTEXT |SPATIAL )?KEY ')
+FOREIGN_KEY = re.compile(rb'^CONSTRAINT .* FOREIGN KEY ')
+
+# Function to run a mysql client fed with the given byte strings and files, returning its exit status
+def run_mysql(parts):
+    client = subprocess.Popen(
+        ['mysql', '-h', backup_config.mysql_host, '-u', backup_config.mysql_user, '--max-allowed-packet=1G'],
+        env=dict(os.environ, MYSQL_PWD=backup_config.mysql_password), stdin=subprocess.PIPE
+    )
+    try:
+        for part in parts:
+            if isinstance(part, bytes):
+                client.stdin.write(part)
+            else:
+                with open(part, 'rb') as f:
+                    shutil.copyfileobj(f, client.stdin, 1024 * 1024)
+    except BrokenPipeError:
+        pass
+    finally:
+        client.stdin.close()
+    return client.wait()
+
+# Function to open a dump, decompressing it on the fly by extension
+def open_dump(path):
+    extension = os.path.splitext(path)[1]
+    if extension not in DECOMPRESSORS:
+        return open(path, 'rb'), None
+    decompressor = subprocess.Popen(decompress_command(extension) + [path], stdout=subprocess.PIPE)
+    return decompressor.stdout, decompressor
+
+# Function to split a CREATE TABLE statement into the statement without secondary indexes and foreign keys,
+# and the deferred index and foreign key definitions. Keys needed by an AUTO_INCREMENT column are kept
+def split_create_table(lines):
+    # The table options (and partitioning) start at the line closing the definitions
+    end = next(index for index, line in enumerate(lines) if index > 0 and line.startswith(b')'))
+    head, body, tail = lines[0], lines[1:end], b''.join(lines[end:])
+    definitions = [line.strip().rstrip(b',') for line in body]
+    auto_increment_columns = {match.group(1) for match in
+                              (re.match(rb'^`([^`]+)` .*AUTO_INCREMENT', definition) for definition in definitions)
+                              if match}
+
+    kept, keys, foreign_keys = [], [], []
+    for definition in definitions:
+        first_column = re.search(rb'\(`([^`]+)`', definition)
+        if SECONDARY_KEY.match(definition) and not (first_column and first_column.group(1) in auto_increment_columns):
+            keys.append(definition)
+        elif FOREIGN_KEY.match(definition):
+            foreign_keys.append(definition)
+        else:
+            kept.append(definition)
+
+    create = head + b',\n'.join(b'  ' + definition for definition in kept) + b'\n' + tail
+    return create, keys, foreign_keys
+
+# Collects INSERT statements of one table into a spool file, merging consecutive statements into large batches
+class TableSpool:
+    def __init__(self, path, batch_bytes):
+        self.path = path
+        self.batch_bytes = batch_bytes
+        self.file = open(path, 'wb')
+        self.prefix = None
+        self.values = []
+        self.size = 0
+
+    def add(self, statement):
+        prefix, separator, values = statement.partition(b' VALUES ')
+        values = values.rstrip().rstrip(b';')
+        if not separator:
+            self.flush()
+            self.file.write(statement)
+            return
+        if prefix != self.prefix or self.size + len(values) > self.batch_bytes:
+            self.flush()
+            self.prefix = prefix
+        self.values.append(values)
+        self.size += len(values)
+
+    def flush(self):
+        if self.values:
+            self.file.write(self.prefix + b' VALUES ' + b','.join(self.values) + b';\n')
+        self.values = []
+        self.size = 0
+
+    def close(self):
+        self.flush()
+        self.file.close()
+
+# Function to stop at a database marker naming another database than the one the dump selected;
+# mysqldump --databases repeats the marker (and USE) of the same database before the final views
+def check_database_marker(line, split):
+    database = DATABASE_MARKER.match(line)
+    if database and database.group(1).decode('utf-8') != split['database']:
+        raise SystemExit("Only single-database dumps are supported, restore each database from its own dump.")
+
+# Function to split a dump in one pass: session settings from the header, the schema script with deferred indexes,
+# one spool file per table, and the post-data script (views, routines, triggers)
+def split_dump(path, spool_dir, batch_bytes):
+    dump, decompressor = open_dump(path)
+    split = {'database': None, 'settings': [], 'schema': [], 'keys': {}, 'foreign_keys': {},
+             'spools': {}, 'post': []}
+    section, table, create_lines, spool, data_done = 'header', None, None, None, False
+
+    try:
+        for line in dump:
+            if section == 'post':
+                # Views, routines and events run to the end of the dump and are passed through as they are,
+                # so comments and blank lines inside routine and trigger bodies are kept
+                check_database_marker(line, split)
+                if not line.startswith(b'USE '):  # The session already selects the database to restore into
+                    split['post'].append(line)
+                continue
+
+            if line.startswith(b'--'):
+                marker = None
+                for pattern, name in ((TABLE_STRUCTURE_MARKER, 'schema'), (TABLE_DATA_MARKER, 'data'),
+                                      (VIEW_PLACEHOLDER_MARKER, 'schema'), (POST_DATA_MARKER, 'post')):
+                    match = pattern.match(line)
+                    if match:
+                        marker = (name, match.group(1).decode('utf-8') if match.groups() else None)
+                        break
+                if section != 'header':
+                    check_database_marker(line, split)
+                if marker:
+                    if spool:
+                        spool.close()
+                        spool = None
+                    section, table = marker
+                    if section == 'data':
+                        spool = TableSpool(os.path.join(spool_dir, f"{len(split['spools'])}.sql"), batch_bytes)
+                        split['spools'][table] = spool.path
+                        data_done = False
+                    continue
+            if line.startswith(b'USE ') and section != 'header':
+                continue  # The session already selects the database to restore into
+            if section == 'data' and data_done:
+                split['post'].append(line)  # Triggers follow the table data
+                continue
+            if line.startswith(b'--') or not line.strip():
+                continue
+
+            if section == 'header':
+                if TABLE_STATEMENT.match(line):
+                    raise SystemExit("The dump has no section comments (made with --compact or --skip-comments), "
+                                     "load it with the mysql client instead.")
+                if line.startswith(b'USE '):
+                    split['database'] = re.match(rb'USE `(.+)`', line).group(1).decode('utf-8')
+                elif not line.startswith(b'CREATE DATABASE'):
+                    split['settings'].append(line)
+            elif section == 'schema':
+                if create_lines is not None or line.startswith(b'CREATE TABLE'):
+                    create_lines = (create_lines or []) + [line]
+                    if line.rstrip().endswith(b';'):
+                        create, keys, foreign_keys = split_create_table(create_lines)
+                        split['schema'].append(create)
+                        if keys:
+                            split['keys'][table] = keys
+                        if foreign_keys:
+                            split['foreign_keys'][table] = foreign_keys
+                        create_lines = None
+                else:
+                    split['schema'].append(line)
+            elif section == 'data':
+                if DATA_STATEMENT.match(line):
+                    spool.add(line)
+                elif not DATA_WRAPPER.match(line):
+                    # The rows end at the first other statement: the triggers of the table follow them
+                    data_done = True
+                    split['post'].append(line)
+    finally:
+        if spool:
+            spool.close()
+        dump.close()
+    if decompressor and decompressor.wait() != 0:
+        raise SystemExit(f"Failed to decompress {path}.")
+    return split
+
+# Function to restore a dump: schema without secondary indexes, table data loaded concurrently,
+# indexes built per table concurrently, then foreign keys, views, routines and triggers
+def restore_dump(path, database=None, jobs=4, spool_dir=None, batch_bytes=DEFAULT_BATCH_BYTES):
+    start = time.time()
+    with tempfile.TemporaryDirectory(dir=spool_dir) as spool_path:
+        print(f"Splitting {path}...")
+        split = split_dump(path, spool_path, batch_bytes)
+        database = database or split['database']
+        if not database:
+            raise SystemExit("The dump doesn't select a database, pass --database.")
+        quoted_database = database.replace('`', '``').encode('utf-8')
+        session = b''.join(split['settings']) + b'SET SESSION unique_checks=0, foreign_key_checks=0;\nUSE `' + quoted_database + b'`;\n'
+        print(f"Split {len(split['spools'])} tables in {time.time() - start:.1f}s, restoring into {database}...")
+
+        create_database = b'CREATE DATABASE IF NOT EXISTS `' + quoted_database + b'`;\n'
+        if run_mysql([create_database, session] + split['schema']) != 0:
+            print("Failed to create the schema.")
+            return False
+
+        # Largest tables first, so the longest loads don't start last; tables dumped without data only get their indexes
+        def spool_size(table):
+            return os.path.getsize(split['spools'][table]) if table in split['spools'] else 0
+
+        tables = sorted(set(split['spools']) | set(split['keys']), key=spool_size, reverse=True)
+
+        # Load a table, then build its secondary indexes in one sorted pass (InnoDB adds FULLTEXT indexes one at a time)
+        def load_table(table):
+            if table in split['spools']:
+                table_start = time.time()
+                if run_mysql([session, split['spools'][table]]) != 0:
+                    print(f"{table}: loading failed")
+                    return False
+                print(f"{table}: loaded {spool_size(table) / (1024 * 1024):.1f} MB in {time.time() - table_start:.1f}s")
+
+            keys = split['keys'].get(table, [])
+            plain_keys = [key for key in keys if not key.startswith(b'FULLTEXT')]
+            alter_table = b'ALTER TABLE `' + table.replace('`', '``').encode('utf-8') + b'` '
+            statements = [alter_table + b', '.join(b'ADD ' + key for key in plain_keys) + b';\n'] if plain_keys else []
+            statements += [alter_table + b'ADD ' + key + b';\n' for key in keys if key.startswith(b'FULLTEXT')]
+            if statements:
+                index_start = time.time()
+                if run_mysql([session] + statements) != 0:
+                    print(f"{table}: building indexes failed")
+                    return False
+                print(f"{table}: built {len(keys)} indexes in {time.time() - index_start:.1f}s")
+            return True
+
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            loaded = dict(zip(tables, executor.map(load_table, tables)))
+
+        # Foreign keys are added without re-checking the restored rows, then the post-data objects
+        foreign_keys = [
+            b'ALTER TABLE `' + table.replace('`', '``').encode('utf-8') + b'` '
+            + b', '.join(b'ADD ' + foreign_key for foreign_key in definitions) + b';\n'
+            for table, definitions in split['foreign_keys'].items()
+        ]
+        post_ok = run_mysql([session] + foreign_keys + split['post']) == 0
+
+    failed = [table for table, ok in loaded.items() if not ok]
+    print(f"Restored {len(tables)} tables in {time.time() - start:.1f}s.")
+    if failed:
+        print(f"Failed tables: {', '.join(failed)}")
+    if not post_ok:
+        print("Failed to restore foreign keys, views, routines or triggers.")
+    return not failed and post_ok
+
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Restore a mysqldump file, loading tables in parallel with deferred indexes.")
+    parser.add_argument("dump", help="Dump file (.sql, .sql.gz or .sql.zst) of one database")
+    parser.add_argument("--database", help="Database to restore into (default: the one in the dump)")
+    parser.add_argument("--jobs", type=int, default=4, help="Number of tables loaded at the same time (default: %(default)s)")
+    parser.add_argument("--spool-dir", help="Directory for the per-table spool files (default: system temp directory)")
+    parser.add_argument("--batch-bytes", type=int, default=DEFAULT_BATCH_BYTES,
+                        help="Maximum size of a merged INSERT statement (default: %(default)s)")
+    args = parser.parse_args()
+
+    if not restore_dump(args.dump, args.database, args.jobs, args.spool_dir, args.batch_bytes):
+        raise SystemExit(1)
+    print("Restore complete.")
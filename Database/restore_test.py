@@ -0,0 +1,184 @@
+import os
+import sys
+import tempfile
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# restore only reads backup_config when it runs the mysql client
+backup_config = types.ModuleType('backup_config')
+backup_config.mysql_host, backup_config.mysql_user, backup_config.mysql_password = 'localhost', 'test', ''
+sys.modules.setdefault('backup_config', backup_config)
+
+import restore
+
+DUMP = b"""-- MySQL dump 10.13
+--
+-- Current Database: `shop`
+--
+
+CREATE DATABASE /*!32312 IF NOT EXISTS*/ `shop`;
+
+USE `shop`;
+/*!40101 SET NAMES utf8mb4 */;
+
+--
+-- Table structure for table `orders`
+--
+
+DROP TABLE IF EXISTS `orders`;
+CREATE TABLE `orders` (
+  `id` int NOT NULL AUTO_INCREMENT,
+  `customer_id` int NOT NULL,
+  `note` varchar(20) DEFAULT NULL,
+  PRIMARY KEY (`id`),
+  KEY `customer` (`customer_id`),
+  CONSTRAINT `orders_customer` FOREIGN KEY (`customer_id`) REFERENCES `customers` (`id`)
+) ENGINE=InnoDB;
+
+--
+-- Dumping data for table `orders`
+--
+
+LOCK TABLES `orders` WRITE;
+/*!40000 ALTER TABLE `orders` DISABLE KEYS */;
+INSERT INTO `orders` VALUES (1,1,'a'),(2,1,'b');
+INSERT INTO `orders` VALUES (3,2,'-- not a comment');
+/*!40000 ALTER TABLE `orders` ENABLE KEYS */;
+UNLOCK TABLES;
+DELIMITER ;;
+CREATE TRIGGER `orders_check` BEFORE INSERT ON `orders` FOR EACH ROW BEGIN
+-- keep the note short
+
+  SET NEW.note = LEFT(NEW.note, 10);
+END ;;
+DELIMITER ;
+
+--
+-- Current Database: `shop`
+--
+
+USE `shop`;
+
+--
+-- Dumping routines for database 'shop'
+--
+DELIMITER ;;
+CREATE PROCEDURE `cleanup`()
+BEGIN
+-- remove empty notes
+
+  DELETE FROM `orders` WHERE `note` = '';
+END ;;
+DELIMITER ;
+"""
+
+
+class SplitCreateTableTest(unittest.TestCase):
+    def test_secondary_keys_and_foreign_keys_are_deferred(self):
+        lines = [
+            b"CREATE TABLE `t` (\n",
+            b"  `id` int NOT NULL AUTO_INCREMENT,\n",
+            b"  `code` int NOT NULL,\n",
+            b"  PRIMARY KEY (`id`),\n",
+            b"  UNIQUE KEY `code` (`code`),\n",
+            b"  CONSTRAINT `t_code` FOREIGN KEY (`code`) REFERENCES `c` (`id`)\n",
+            b") ENGINE=InnoDB;\n",
+        ]
+        create, keys, foreign_keys = restore.split_create_table(lines)
+        self.assertEqual(create, b"CREATE TABLE `t` (\n  `id` int NOT NULL AUTO_INCREMENT,\n  `code` int NOT NULL,\n"
+                                 b"  PRIMARY KEY (`id`)\n) ENGINE=InnoDB;\n")
+        self.assertEqual(keys, [b"UNIQUE KEY `code` (`code`)"])
+        self.assertEqual(foreign_keys, [b"CONSTRAINT `t_code` FOREIGN KEY (`code`) REFERENCES `c` (`id`)"])
+
+    def test_key_needed_by_auto_increment_is_kept(self):
+        lines = [
+            b"CREATE TABLE `t` (\n",
+            b"  `seq` int NOT NULL AUTO_INCREMENT,\n",
+            b"  `id` int NOT NULL,\n",
+            b"  PRIMARY KEY (`id`),\n",
+            b"  KEY `seq` (`seq`)\n",
+            b") ENGINE=InnoDB;\n",
+        ]
+        create, keys, _ = restore.split_create_table(lines)
+        self.assertIn(b"KEY `seq` (`seq`)", create)
+        self.assertEqual(keys, [])
+
+
+class TableSpoolTest(unittest.TestCase):
+    def spool(self, statements, batch_bytes):
+        with tempfile.TemporaryDirectory() as folder:
+            spool = restore.TableSpool(os.path.join(folder, 'spool.sql'), batch_bytes)
+            for statement in statements:
+                spool.add(statement)
+            spool.close()
+            with open(spool.path, 'rb') as f:
+                return f.read()
+
+    def test_consecutive_inserts_are_merged(self):
+        statements = [b"INSERT INTO `t` VALUES (1);\n", b"INSERT INTO `t` VALUES (2),(3);\n"]
+        self.assertEqual(self.spool(statements, 1024), b"INSERT INTO `t` VALUES (1),(2),(3);\n")
+
+    def test_batches_are_split_at_the_size_limit(self):
+        statements = [b"INSERT INTO `t` VALUES (1);\n", b"INSERT INTO `t` VALUES (2);\n"]
+        self.assertEqual(self.spool(statements, 4), b"INSERT INTO `t` VALUES (1);\nINSERT INTO `t` VALUES (2);\n")
+
+
+class SplitDumpTest(unittest.TestCase):
+    def setUp(self):
+        self.folder = tempfile.TemporaryDirectory()
+        self.addCleanup(self.folder.cleanup)
+        path = os.path.join(self.folder.name, 'shop.sql')
+        with open(path, 'wb') as f:
+            f.write(DUMP)
+        self.split = restore.split_dump(path, self.folder.name, 1024)
+
+    def test_header_schema_and_data_are_separated(self):
+        self.assertEqual(self.split['database'], 'shop')
+        self.assertEqual(self.split['settings'], [b"/*!40101 SET NAMES utf8mb4 */;\n"])
+        self.assertEqual(self.split['keys'], {'orders': [b"KEY `customer` (`customer_id`)"]})
+        self.assertIn('orders', self.split['foreign_keys'])
+        with open(self.split['spools']['orders'], 'rb') as f:
+            self.assertEqual(f.read(), b"INSERT INTO `orders` VALUES (1,1,'a'),(2,1,'b'),(3,2,'-- not a comment');\n")
+
+    def test_trigger_and_routine_bodies_keep_comments_and_blank_lines(self):
+        post = b''.join(self.split['post'])
+        self.assertIn(b"BEGIN\n-- keep the note short\n\n  SET NEW.note", post)
+        self.assertIn(b"BEGIN\n-- remove empty notes\n\n  DELETE FROM", post)
+        self.assertNotIn(b"USE `shop`", post)
+
+    def split_variant(self, dump):
+        path = os.path.join(self.folder.name, 'variant.sql')
+        with open(path, 'wb') as f:
+            f.write(dump)
+        return restore.split_dump(path, self.folder.name, 1024)
+
+    def test_replace_and_insert_ignore_rows_are_loaded(self):
+        dump = DUMP.replace(b"INSERT INTO `orders` VALUES (1,1,'a')", b"REPLACE INTO `orders` VALUES (1,1,'a')")
+        dump = dump.replace(b"INSERT INTO `orders` VALUES (3,", b"INSERT IGNORE INTO `orders` VALUES (3,")
+        with open(self.split_variant(dump)['spools']['orders'], 'rb') as f:
+            self.assertEqual(f.read(), b"REPLACE INTO `orders` VALUES (1,1,'a'),(2,1,'b');\n"
+                                       b"INSERT IGNORE INTO `orders` VALUES (3,2,'-- not a comment');\n")
+
+    def test_triggers_are_kept_without_table_locks(self):
+        dump = DUMP.replace(b"LOCK TABLES `orders` WRITE;\n", b"").replace(b"UNLOCK TABLES;\n", b"")
+        post = b''.join(self.split_variant(dump)['post'])
+        self.assertIn(b"CREATE TRIGGER `orders_check`", post)
+        self.assertNotIn(b"ENABLE KEYS", post)
+
+    def test_dump_without_section_comments_is_rejected(self):
+        compact = b"/*!40101 SET NAMES utf8mb4 */;\nCREATE TABLE `t` (\n  `id` int\n) ENGINE=InnoDB;\nINSERT INTO `t` VALUES (1);\n"
+        with self.assertRaises(SystemExit):
+            self.split_variant(compact)
+
+    def test_dump_of_another_database_is_rejected(self):
+        path = os.path.join(self.folder.name, 'two.sql')
+        with open(path, 'wb') as f:
+            f.write(DUMP + b"\n--\n-- Current Database: `other`\n--\n")
+        with self.assertRaises(SystemExit):
+            restore.split_dump(path, self.folder.name, 1024)
+
+
+if __name__ == '__main__':
+    unittest.main()
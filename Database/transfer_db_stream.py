@@ -0,0 +1,158 @@
+import argparse
+import getpass
+import os
+import shlex
+import shutil
+import subprocess
+import time
+import transfer_db_stream_config as config
+from compression import CODECS, DECOMPRESSORS
+from concurrent.futures import ThreadPoolExecutor
+
+# Function to build the ssh command for the target; with a password sshpass reads it from SSHPASS
+def ssh_command(ssh_password):
+    destination = f"{config.target_ssh_user}@{config.target_host}"
+    if ssh_password:
+        return ['sshpass', '-e', 'ssh', destination]
+    return ['ssh', destination]
+
+# Function to run a shell command on the target server and return its exit status
+def run_remote(command, passwords):
+    return subprocess.run(ssh_command(passwords['ssh']) + [command],
+                          env=dict(os.environ, SSHPASS=passwords['ssh'])).returncode
+
+# Function to write the target MySQL password to a private option file on the target and return its path.
+# The file is sent over the ssh stdin, so the password is in no command line on either server
+def create_remote_option_file(passwords):
+    escaped = passwords['target'].replace('\\', '\\\\').replace('"', '\\"')
+    result = subprocess.run(ssh_command(passwords['ssh']) + ['umask 077 && f=$(mktemp) && cat > "$f" && echo "$f"'],
+                            input=f'[client]\npassword="{escaped}"\n', stdout=subprocess.PIPE, text=True,
+                            env=dict(os.environ, SSHPASS=passwords['ssh']))
+    if result.returncode != 0:
+        return None
+    return result.stdout.strip()
+
+# Function to build the remote mysql command loading into the target database, reading the password from the option file
+def remote_mysql(option_file, *options):
+    return (f"mysql --defaults-extra-file={shlex.quote(option_file)} -u {shlex.quote(config.target_mysql_user)} "
+            + ' '.join(shlex.quote(option) for option in options))
+
+# Function to pick zstd when both servers have it, gzip otherwise (compressed with pigz when installed locally)
+def select_codec(passwords):
+    if shutil.which('zstd') and run_remote('command -v zstd > /dev/null', passwords) == 0:
+        return 'zstd'
+    return 'pigz' if shutil.which('pigz') else 'gzip'
+
+# Function to list the base tables of the source database
+def list_source_tables(passwords):
+    output = subprocess.run(
+        ['mysql', '-h', config.source_host, '-u', config.source_user, '-N', '-B',
+         '-e', "SHOW FULL TABLES WHERE Table_type = 'BASE TABLE'", config.source_db],
+        env=dict(os.environ, MYSQL_PWD=passwords['source']), check=True, capture_output=True, text=True
+    ).stdout
+    return [line.split('\t')[0] for line in output.splitlines()]
+
+# Function to run one stream: mysqldump | compress | ssh "decompress | mysql", connected by OS pipes only,
+# so nothing is written to disk on either server and all stages run at the same time
+def run_stream(label, dump_options, tables, codec, threads, passwords, option_file):
+    compress_command, extension, level = CODECS[codec]
+    # pipefail makes the remote exit status report a failed decompress, not only a failed mysql
+    remote_pipeline = f"{shlex.join(DECOMPRESSORS[extension])} | {remote_mysql(option_file, config.target_db)}"
+    remote_command = f"bash -o pipefail -c {shlex.quote(remote_pipeline)}"
+    start = time.time()
+
+    dump = subprocess.Popen(
+        ['mysqldump', '-h', config.source_host, '-u', config.source_user,
+         *config.mysqldump_options, *dump_options, config.source_db, *tables],
+        env=dict(os.environ, MYSQL_PWD=passwords['source']), stdout=subprocess.PIPE
+    )
+    compressor = subprocess.Popen(compress_command(level, threads), stdin=dump.stdout, stdout=subprocess.PIPE)
+    dump.stdout.close()
+    remote = subprocess.Popen(ssh_command(passwords['ssh']) + [remote_command], stdin=compressor.stdout,
+                              env=dict(os.environ, SSHPASS=passwords['ssh']))
+    compressor.stdout.close()
+
+    remote_status = remote.wait()
+    compressor_status = compressor.wait()
+    dump_status = dump.wait()
+    if dump_status != 0 or compressor_status != 0 or remote_status != 0:
+        print(f"{label}: transfer failed (mysqldump exit {dump_status}, {codec} exit {compressor_status}, "
+              f"remote import exit {remote_status})")
+        return False
+    print(f"{label}: transferred in {time.time() - start:.1f}s")
+    return True
+
+# Function to transfer the database: the schema first, then the table data in parallel streams,
+# then the triggers so they don't fire while the data is loaded. Each parallel stream dumps its table in its
+# own transaction, so the copy is consistent per table but not across tables: rows written to the source
+# during the transfer can leave foreign keys in the target pointing at missing rows. With one job the data
+# is dumped by a single stream in one transaction, consistent like transfer_db_between_servers.sh
+def transfer_database(passwords, tables=None, jobs=4):
+    codec = select_codec(passwords)
+    threads = max(1, (os.cpu_count() or 1) // jobs)  # Share the cores between the streams
+    selected = tables or list_source_tables(passwords)
+    print(f"Streaming {config.source_db} to {config.target_host}/{config.target_db} "
+          f"({len(selected)} tables, {jobs} streams, {codec})...")
+    start = time.time()
+
+    option_file = create_remote_option_file(passwords)
+    if not option_file:
+        print("Failed to write the MySQL option file on the target.")
+        return False
+    try:
+        create_database = f"CREATE DATABASE IF NOT EXISTS `{config.target_db.replace('`', '``')}`"
+        if run_remote(remote_mysql(option_file, '-e', create_database), passwords) != 0:
+            print("Failed to create the target database.")
+            return False
+
+        schema_tables = tables or []
+        if not run_stream('schema', ['--no-data', '--skip-triggers', '--routines', '--events'], schema_tables,
+                          codec, threads, passwords, option_file):
+            return False
+
+        data_options = ['--single-transaction', '--no-create-info', '--skip-triggers']
+        if jobs == 1:
+            data_ok = run_stream('data', data_options, schema_tables, codec, threads, passwords, option_file)
+            failed = [] if data_ok else selected
+        else:
+            with ThreadPoolExecutor(max_workers=jobs) as executor:
+                results = list(executor.map(
+                    lambda table: run_stream(table, data_options, [table], codec, threads, passwords, option_file),
+                    selected
+                ))
+            failed = [table for table, ok in zip(selected, results) if not ok]
+
+        triggers_ok = run_stream('triggers', ['--no-data', '--no-create-info', '--triggers'], schema_tables,
+                                 codec, threads, passwords, option_file)
+    finally:
+        run_remote(f"rm -f {shlex.quote(option_file)}", passwords)
+
+    print(f"Transferred {len(selected) - len(failed)}/{len(selected)} tables in {time.time() - start:.1f}s.")
+    if failed:
+        print(f"Failed tables: {', '.join(failed)}")
+    return not failed and triggers_ok
+
+
+# Main code
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Stream a MySQL database to another server over ssh without temporary files.")
+    parser.add_argument("--tables", help="Comma-separated list of tables to transfer (default: all tables)")
+    parser.add_argument("--jobs", type=int, default=4,
+                        help="Number of tables streamed at the same time, each in its own transaction, so the copy is not "
+                             "consistent across tables while the source is written to; 1 streams all the data in one "
+                             "consistent transaction (default: %(default)s)")
+    args = parser.parse_args()
+
+    # Prompt for the passwords, like transfer_db_between_servers.sh
+    passwords = {'source': getpass.getpass(f"Enter password for source MySQL user {config.source_user}: ")}
+    passwords['target'] = getpass.getpass(
+        f"Enter password for target MySQL user {config.target_mysql_user} (Press Enter if same as source): "
+    ) or passwords['source']
+    passwords['ssh'] = getpass.getpass(
+        f"Enter SSH password for user {config.target_ssh_user}@{config.target_host} (Press Enter to use SSH keys): "
+    )
+
+    tables = [table.strip() for table in args.tables.split(',')] if args.tables else None
+    if not transfer_database(passwords, tables, args.jobs):
+        raise SystemExit(1)
+    print("Database transfer complete.")
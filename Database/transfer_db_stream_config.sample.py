@@ -0,0 +1,12 @@
+# transfer_db_stream_config.sample.py
+source_host = "localhost"
+source_user = "<user>"
+source_db = "dodomax20"
+
+target_host = "<target host>"
+target_ssh_user = "<ssh user>"
+target_mysql_user = "<user>"
+target_db = "dodomax20"
+
+# Options passed to mysqldump for every stream
+mysqldump_options = ["--opt"]
@@ -1,6 +1,19 @@
+import argparse
 import compare_db_config
+import datetime
 import json
-from sqlalchemy import create_engine, MetaData, Table, text
+import os
+import pickle
+import sqlite3
+import tempfile
+import threading
+import time
+from compare_db import row_checksum_sql
+from concurrent.futures import ThreadPoolExecutor
+from dependency_order import order_levels
+from sqlalchemy import create_engine, MetaData, Table, text, select, func, and_, true, literal_column
+from sqlalchemy.types import Integer
+from sqlalchemy.dialects import mysql, postgresql, sqlite
 from sqlalchemy.schema import CreateTable
 from sqlalchemy.orm import sessionmaker
 
@@ -19,6 +32,21 @@ session_db2 = SessionDB2()
 metadata_db1 = MetaData()
 metadata_db1.reflect(bind=engine_db1)
 
+# Number of rows read from db1 and written to db2 per round trip
+DEFAULT_BATCH_SIZE = 5000
+
+# Local file recording the progress of every table range, used by --resume
+DEFAULT_JOURNAL_PATH = "transfer_checkpoint.db"
+
+# Column used to find changed rows in incremental mode, falling back to an integer primary key
+DEFAULT_WATERMARK_COLUMN = "updated_at"
+
+# Number of primary key ranges compared when verifying a copied table
+DEFAULT_VERIFY_RANGES = 16
+
+# Cleared when db2's bulk loader fails, so the rest of the run uses batched inserts
+bulk_loader_available = True
+
 def list_tables():
     """List all the tables in the source database (db1)"""
     tables = list(metadata_db1.tables.keys())
@@ -34,99 +62,767 @@ def select_tables(tables):
     selected_tables = [tables[i] for i in selected_indices]
     return selected_tables
 
-def convert_to_sql_values(row):
-    """Converts a dictionary row to SQL value syntax, with proper escaping."""
-    values = []
-    
-    for value in row.values():
-        if isinstance(value, dict):
-            # Assuming the value is JSON-like, we serialize it to a string
-            json_str = json.dumps(value)  # Convert Python dict to JSON string
-            escaped_value = json_str.replace("'", "''")  # Escape single quotes inside the JSON string
-            values.append(f"'{escaped_value}'")
-        elif isinstance(value, str):
-            # Escape single quotes in regular strings
-            escaped_value = value.replace("'", "''")
-            values.append(f"'{escaped_value}'")
-        elif value is None:
-            # Handle NULL values
-            values.append("NULL")
-        elif isinstance(value, (int, float)):
-            # Directly convert integers and floats
-            values.append(str(value))
-        else:
-            # Fallback for other types, convert to string and escape
-            escaped_value = str(value).replace("'", "''")
-            values.append(f"'{escaped_value}'")
-    
-    # Return the formatted values as a tuple in SQL syntax
-    return f"({', '.join(values)})"
+def insert_batch(conn_db2, table_db1, batch):
+    """
+    Insert a batch of rows into db2 with a single executemany call.
+    Values are sent as bound parameters, so the driver handles typing and escaping
+    of bytes, Decimal, datetime and JSON columns.
+    """
+    conn_db2.execute(table_db1.insert(), [row._asdict() for row in batch])
 
+def upsert_batch(conn_db2, table_db1, batch):
+    """
+    Insert a batch of rows into db2, overwriting rows whose primary key already exists.
+    Uses the native upsert of MySQL, PostgreSQL and SQLite, and delete-then-insert elsewhere.
+    """
+    rows = [row._asdict() for row in batch]
+    dialect_name = engine_db2.dialect.name
 
-def generate_insert_sql(table_name, columns, data_to_insert):
-    """Generates raw SQL INSERT statements."""
-    column_names = ', '.join(columns)
-    values_sql = ',\n'.join([convert_to_sql_values(row) for row in data_to_insert])
+    if dialect_name == 'mysql':
+        stmt = mysql.insert(table_db1)
+        stmt = stmt.on_duplicate_key_update({column.name: stmt.inserted[column.name] for column in table_db1.columns})
+    elif dialect_name in ('postgresql', 'sqlite'):
+        insert = postgresql.insert if dialect_name == 'postgresql' else sqlite.insert
+        stmt = insert(table_db1)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=[column.name for column in table_db1.primary_key.columns],
+            set_={column.name: stmt.excluded[column.name] for column in table_db1.columns}
+        )
+    else:
+        pk_column = single_primary_key(table_db1)
+        conn_db2.execute(table_db1.delete().where(pk_column.in_([row[pk_column.name] for row in rows])))
+        stmt = table_db1.insert()
 
-    insert_sql = f"INSERT INTO {table_name} ({column_names}) VALUES\n{values_sql};"
-    return insert_sql
+    conn_db2.execute(stmt, rows)
 
-def transfer_structure_and_data(selected_tables):
+def bulk_field(value, dialect_name):
     """
-    Transfer the structure (table definitions) and data for selected tables from db1 to db2.
-    Generates raw SQL INSERT statements.
+    Encode one value for the tab-delimited text format read by MySQL's LOAD DATA and
+    PostgreSQL's COPY: NULL is \\N and backslash, tab and line breaks are backslash-escaped.
     """
-    # Open connections for both databases
-    with engine_db1.connect() as conn_db1, engine_db2.connect() as conn_db2:
-        for table_name in selected_tables:
-            print(f"\nProcessing table: {table_name}")
+    if value is None:
+        return b'\\N'
+    if isinstance(value, (bytes, bytearray, memoryview)):
+        if dialect_name == 'postgresql':
+            return b'\\\\x' + bytes(value).hex().encode('ascii')
+        encoded = bytes(value)
+    else:
+        if isinstance(value, bool):
+            value = ('t' if value else 'f') if dialect_name == 'postgresql' else int(value)
+        elif isinstance(value, (dict, list)):
+            value = json.dumps(value)
+        elif isinstance(value, (set, frozenset)):
+            value = ','.join(sorted(value))
+        elif isinstance(value, datetime.timedelta):
+            # TIME and interval values as [-]H:MM:SS.ffffff, valid beyond 24 hours for both databases
+            sign = '-' if value < datetime.timedelta(0) else ''
+            seconds, microseconds = divmod(abs(value) // datetime.timedelta(microseconds=1), 1000000)
+            value = f"{sign}{seconds // 3600}:{seconds % 3600 // 60:02d}:{seconds % 60:02d}.{microseconds:06d}"
+        encoded = str(value).encode('utf-8')
+
+    encoded = encoded.replace(b'\\', b'\\\\').replace(b'\t', b'\\t').replace(b'\n', b'\\n').replace(b'\r', b'\\r')
+    if dialect_name == 'mysql':
+        encoded = encoded.replace(b'\0', b'\\0')
+    return encoded
 
-            # Get the table structure from db1
-            table_db1 = metadata_db1.tables[table_name]
+def bulk_load_batch(conn_db2, table_db1, batch):
+    """
+    Load a batch into db2 with its native bulk loader: the rows are spooled to a temporary
+    tab-delimited file read by LOAD DATA LOCAL INFILE (MySQL) or COPY FROM STDIN (PostgreSQL).
+    """
+    dialect_name = engine_db2.dialect.name
+    preparer = engine_db2.dialect.identifier_preparer
+    table_sql = preparer.format_table(table_db1)
+    columns_sql = ', '.join(preparer.quote(column.name) for column in table_db1.columns)
+
+    with tempfile.NamedTemporaryFile(suffix='.tsv', delete=False) as spool:
+        for row in batch:
+            spool.write(b'\t'.join(bulk_field(value, dialect_name) for value in row) + b'\n')
+    try:
+        if dialect_name == 'mysql':
+            # The keys of the table are disabled for the whole level, uniqueness and foreign key checks per load
+            conn_db2.execute(text("SET SESSION unique_checks = 0, foreign_key_checks = 0"))
+            try:
+                conn_db2.execute(
+                    text(f"LOAD DATA LOCAL INFILE :path INTO TABLE {table_sql} CHARACTER SET utf8mb4 "
+                         f"FIELDS TERMINATED BY '\\t' ESCAPED BY '\\\\' LINES TERMINATED BY '\\n' ({columns_sql})"),
+                    {'path': spool.name}
+                )
+            finally:
+                conn_db2.execute(text("SET SESSION unique_checks = 1, foreign_key_checks = 1"))
+        else:
+            if not conn_db2.in_transaction():
+                conn_db2.begin()
+            with conn_db2.connection.cursor() as cursor, open(spool.name, 'rb') as f:
+                copy_sql = f"COPY {table_sql} ({columns_sql}) FROM STDIN"
+                if hasattr(cursor, 'copy_expert'):
+                    cursor.copy_expert(copy_sql, f)  # psycopg2
+                else:
+                    with cursor.copy(copy_sql) as copy:  # psycopg 3
+                        copy.write(f.read())
+    finally:
+        os.remove(spool.name)
 
-            # Generate the Create Table SQL for db2 (target database)
-            create_table_sql = str(CreateTable(table_db1).compile(engine_db2))
+def write_batch(conn_db2, table_db1, batch, bulk_load=False):
+    """
+    Write a batch into db2 with the bulk loader when requested and available, otherwise
+    with batched inserts. A failing bulk load is rolled back and the run falls back to inserts.
+    """
+    global bulk_loader_available
+    if bulk_load and bulk_loader_available and engine_db2.dialect.name in ('mysql', 'postgresql'):
+        try:
+            bulk_load_batch(conn_db2, table_db1, batch)
+            return
+        except Exception as e:
+            conn_db2.rollback()
+            bulk_loader_available = False
+            print("Bulk load failed, falling back to batched inserts "
+                  "(MySQL needs local_infile enabled on the server and local_infile=1 in db2_url).")
+            print(e)
+    insert_batch(conn_db2, table_db1, batch)
 
-            # Create the table in db2
-            print(f"Creating table in db2: {table_name}")
+def set_keys_enabled(table_names, enabled):
+    """
+    Enable or disable the non-unique indexes of MySQL tables in db2 around a bulk load.
+    DISABLE KEYS only applies to MyISAM tables; InnoDB ignores it and keeps updating its indexes.
+    """
+    if engine_db2.dialect.name != 'mysql':
+        return
+    preparer = engine_db2.dialect.identifier_preparer
+    with engine_db2.connect() as conn_db2:
+        for table_name in table_names:
             try:
-                conn_db2.execute(text(create_table_sql))
+                table_sql = preparer.format_table(metadata_db1.tables[table_name])
+                conn_db2.execute(text(f"ALTER TABLE {table_sql} {'ENABLE' if enabled else 'DISABLE'} KEYS"))
             except Exception as e:
-                print(f"Table {table_name} already exists or failed to create. Skipping creation.")
+                print(f"Failed to {'enable' if enabled else 'disable'} keys for table {table_name}.")
                 print(e)
+        conn_db2.commit()
 
-            # Transfer the data
-            print(f"Transferring data for table: {table_name}")
-            try:
-                # Fetch all data from db1
-                result = conn_db1.execute(table_db1.select()).fetchall()
-                
-                if not result:
-                    print(f"No data to transfer for table: {table_name}")
-                    continue
+def fetch_batches(conn_db1, table_db1, batch_size, query=None):
+    """Stream rows from db1 through a server-side cursor, yielding lists of at most batch_size rows."""
+    if query is None:
+        query = table_db1.select()
+    result = conn_db1.execute(query.execution_options(stream_results=True, yield_per=batch_size))
+    for batch in result.partitions(batch_size):
+        yield batch
 
-                # Convert the result into dictionaries with column names
-                data_to_insert = [
-                    {column.name: value for column, value in zip(table_db1.columns, row)}
-                    for row in result
-                ]
+def referenced_tables(table_name):
+    """Return the other tables a table references through foreign keys."""
+    return {fk.column.table.key for fk in metadata_db1.tables[table_name].foreign_keys} - {table_name}
 
-                # Generate raw SQL INSERT statements
-                column_names = [column.name for column in table_db1.columns]
-                insert_sql = generate_insert_sql(table_name, column_names, data_to_insert)
+def dependency_levels(table_names):
+    """
+    Group tables into levels so that every table comes after the tables it references
+    through foreign keys. Tables within one level are independent of each other.
+    """
+    return order_levels({table_name: referenced_tables(table_name) for table_name in table_names})
 
-                # Print or execute the raw SQL
-                print(f"Generated SQL for {table_name}:\n{insert_sql}")
-                conn_db2.execute(text(insert_sql))
-                conn_db2.commit()
+def size_connection_pools(jobs):
+    """
+    Recreate both engines with a pool of at least `jobs` connections, as every worker holds
+    one connection to each database and the default pool would make extra workers time out.
+    """
+    global engine_db1, engine_db2
+    if jobs <= engine_db1.pool.size():
+        return
+    engine_db1.dispose()
+    engine_db2.dispose()
+    engine_db1 = create_engine(compare_db_config.db1_url, pool_size=jobs)
+    engine_db2 = create_engine(compare_db_config.db2_url, pool_size=jobs)
 
-            except Exception as e:
-                print(f"Failed to transfer data for table: {table_name}")
-                print(f"Error: {e}")
+def create_table_structure(conn_db2, table_name):
+    """Create the table definition from db1 in db2, skipping tables that already exist."""
+    table_db1 = metadata_db1.tables[table_name]
+
+    # Generate the Create Table SQL for db2 (target database)
+    create_table_sql = str(CreateTable(table_db1).compile(engine_db2))
+
+    print(f"Creating table in db2: {table_name}")
+    try:
+        conn_db2.execute(text(create_table_sql))
+        conn_db2.commit()
+    except Exception as e:
+        # Roll back so a failed CREATE doesn't abort the transaction of the next ones (PostgreSQL)
+        conn_db2.rollback()
+        print(f"Table {table_name} already exists or failed to create. Skipping creation.")
+        print(e)
+
+def print_progress(table_name, total_rows, start_time, label="rows transferred"):
+    """Print a progress line with the row count and throughput for one table."""
+    elapsed = time.perf_counter() - start_time
+    rate = total_rows / elapsed if elapsed > 0 else 0
+    print(f"  {table_name}: {total_rows} {label} in {elapsed:.1f}s ({rate:.0f} rows/sec)")
+
+def single_primary_key(table_db1):
+    """Return the primary key column of a table keyed on a single column, otherwise None."""
+    pk_columns = list(table_db1.primary_key.columns)
+    return pk_columns[0] if len(pk_columns) == 1 else None
+
+def split_pk_ranges(conn_db1, table_db1, pk_column, chunks):
+    """
+    Split the primary key space of a table into up to `chunks` ranges.
+    Each range is a (lower, upper) pair with an exclusive lower and inclusive upper bound,
+    None meaning unbounded. Integer keys are split evenly between MIN and MAX, other keys
+    into groups of equal row counts found in a single pass over the primary key index.
+    """
+    if chunks <= 1:
+        return [(None, None)]
+
+    if isinstance(pk_column.type, Integer):
+        min_pk, max_pk = conn_db1.execute(select(func.min(pk_column), func.max(pk_column))).one()
+        if min_pk is None:
+            return [(None, None)]
+        span = max_pk - min_pk + 1
+        split_points = {min_pk - 1 + span * i // chunks for i in range(1, chunks)}
+    else:
+        # One ordered pass over the key index: NTILE numbers the keys into equal groups and
+        # the highest key of every group but the last is a split point
+        numbered = select(
+            pk_column.label('pk'), func.ntile(chunks).over(order_by=pk_column).label('tile')
+        ).subquery()
+        query = select(func.max(numbered.c.pk)).group_by(numbered.c.tile).order_by(numbered.c.tile)
+        split_points = set(conn_db1.execute(query).scalars().all()[:-1])
+
+    # The outer ranges stay open so rows outside the sampled MIN/MAX are still copied
+    split_points = sorted(split_points)
+    return list(zip([None] + split_points, split_points + [None]))
+
+def plan_table_ranges(table_name, chunks):
+    """
+    Return the primary key ranges to copy a table in, or None when the table has no
+    single-column primary key and has to be streamed as a whole.
+    """
+    table_db1 = metadata_db1.tables[table_name]
+    pk_column = single_primary_key(table_db1)
+    if pk_column is None:
+        return None
+
+    with engine_db1.connect() as conn_db1:
+        return split_pk_ranges(conn_db1, table_db1, pk_column, chunks)
+
+class CheckpointJournal:
+    """
+    Local SQLite journal of the last primary key committed to db2 for every range of
+    every table, so an interrupted transfer can continue where it stopped.
+    """
+
+    def __init__(self, path):
+        self.lock = threading.Lock()
+        self.conn = sqlite3.connect(path, check_same_thread=False)
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS checkpoints ("
+            "table_name TEXT, chunk INTEGER, pk_range BLOB, last_pk BLOB, done INTEGER, "
+            "PRIMARY KEY (table_name, chunk))"
+        )
+        self.conn.execute(
+            "CREATE TABLE IF NOT EXISTS watermarks ("
+            "table_name TEXT PRIMARY KEY, column_name TEXT, value BLOB)"
+        )
+        self.conn.commit()
+
+    def start_table(self, table_name, pk_ranges):
+        """Forget earlier progress for a table and record the ranges it is copied in."""
+        with self.lock:
+            self.conn.execute("DELETE FROM checkpoints WHERE table_name = ?", (table_name,))
+            self.conn.executemany(
+                "INSERT INTO checkpoints VALUES (?, ?, ?, NULL, 0)",
+                [(table_name, chunk, pickle.dumps(pk_range)) for chunk, pk_range in enumerate(pk_ranges)]
+            )
+            self.conn.commit()
+
+    def load_table(self, table_name):
+        """Return the recorded ranges of a table as (chunk, pk_range, last_pk, done) tuples."""
+        with self.lock:
+            rows = self.conn.execute(
+                "SELECT chunk, pk_range, last_pk, done FROM checkpoints WHERE table_name = ? ORDER BY chunk",
+                (table_name,)
+            ).fetchall()
+        return [
+            (chunk, pickle.loads(pk_range), pickle.loads(last_pk) if last_pk is not None else None, bool(done))
+            for chunk, pk_range, last_pk, done in rows
+        ]
+
+    def record(self, table_name, chunk, last_pk=None, done=False):
+        """Record the last primary key committed to db2 for a range, or that the range is done."""
+        with self.lock:
+            if done:
+                self.conn.execute(
+                    "UPDATE checkpoints SET done = 1 WHERE table_name = ? AND chunk = ?",
+                    (table_name, chunk)
+                )
+            else:
+                self.conn.execute(
+                    "UPDATE checkpoints SET last_pk = ? WHERE table_name = ? AND chunk = ?",
+                    (pickle.dumps(last_pk), table_name, chunk)
+                )
+            self.conn.commit()
+
+    def load_watermark(self, table_name, column_name):
+        """Return the highest watermark synced for a table, or None if it was never synced on this column."""
+        with self.lock:
+            row = self.conn.execute(
+                "SELECT value FROM watermarks WHERE table_name = ? AND column_name = ?",
+                (table_name, column_name)
+            ).fetchone()
+        return pickle.loads(row[0]) if row else None
+
+    def save_watermark(self, table_name, column_name, value):
+        """Record the highest watermark synced for a table."""
+        with self.lock:
+            self.conn.execute(
+                "INSERT OR REPLACE INTO watermarks VALUES (?, ?, ?)",
+                (table_name, column_name, pickle.dumps(value))
+            )
+            self.conn.commit()
+
+    def close(self):
+        """Close the journal file."""
+        self.conn.close()
+
+def copy_table_data(task, batch_size, bulk_load=False):
+    """
+    Copy all the data of one table through a streaming cursor on its own pair of pooled connections.
+    Returns the number of rows copied.
+    """
+    table_db1 = metadata_db1.tables[task['table_name']]
+    start_time = time.perf_counter()
+    total_rows = 0
+
+    with engine_db1.connect() as conn_db1, engine_db2.connect() as conn_db2:
+        if task['resumed']:
+            # Without a usable key there is no position to continue from, so start the table over
+            print(f"Table {task['table_name']} has no single-column primary key, clearing it in db2 and copying it again.")
+            conn_db2.execute(table_db1.delete())
+            conn_db2.commit()
+
+        # Write each batch as soon as it is read, committing per batch
+        for batch in fetch_batches(conn_db1, table_db1, batch_size):
+            write_batch(conn_db2, table_db1, batch, bulk_load)
+            conn_db2.commit()
+
+            total_rows += len(batch)
+            print_progress(task['progress_name'], total_rows, start_time)
+
+    return total_rows
+
+def pk_range_condition(pk_column, lower, upper):
+    """Build the WHERE clause selecting the keys in (lower, upper]."""
+    conditions = []
+    if lower is not None:
+        conditions.append(pk_column > lower)
+    if upper is not None:
+        conditions.append(pk_column <= upper)
+    return and_(true(), *conditions)
+
+def copy_pk_range(task, batch_size, journal, bulk_load=False):
+    """
+    Copy the rows of one primary key range using keyset pagination: every batch starts
+    right after the last key of the previous one, so no OFFSET scans are needed.
+    The last committed key is written to the journal (if given) after every batch.
+    Returns the number of rows copied.
+    """
+    table_db1 = metadata_db1.tables[task['table_name']]
+    pk_column = single_primary_key(table_db1)
+    lower, upper = task['pk_range']
+    last_pk = task['last_pk'] if task['last_pk'] is not None else lower
+    start_time = time.perf_counter()
+    total_rows = 0
+
+    with engine_db1.connect() as conn_db1, engine_db2.connect() as conn_db2:
+        if task['resumed']:
+            # A batch may have been committed to db2 just before the journal write was lost
+            query = select(func.max(pk_column)).where(pk_range_condition(pk_column, lower, upper))
+            committed_pk = conn_db2.execute(query).scalar()
+            if committed_pk is not None and (last_pk is None or committed_pk > last_pk):
+                last_pk = committed_pk
+
+        while True:
+            query = table_db1.select().where(pk_range_condition(pk_column, last_pk, upper))
+            query = query.order_by(pk_column).limit(batch_size)
+
+            batch = conn_db1.execute(query).fetchall()
+            if not batch:
+                break
 
+            write_batch(conn_db2, table_db1, batch, bulk_load)
+            conn_db2.commit()
+
+            last_pk = batch[-1]._mapping[pk_column]
+            if journal is not None:
+                journal.record(task['table_name'], task['chunk'], last_pk)
+            total_rows += len(batch)
+            print_progress(task['progress_name'], total_rows, start_time)
+
+            if len(batch) < batch_size:
+                break
+
+    return total_rows
+
+def run_copy_task(task, batch_size, journal, bulk_load=False):
+    """
+    Copy a whole table or one primary key range of it, reporting failures instead of
+    raising them. Returns (rows copied, succeeded, start time, end time).
+    """
+    start_time = time.perf_counter()
+    try:
+        if task['pk_range'] is None:
+            total_rows = copy_table_data(task, batch_size, bulk_load)
+        else:
+            total_rows = copy_pk_range(task, batch_size, journal, bulk_load)
+        journal.record(task['table_name'], task['chunk'], done=True)
+        return total_rows, True, start_time, time.perf_counter()
+    except Exception as e:
+        print(f"Failed to transfer data for table: {task['progress_name']}")
+        print(f"Error: {e}")
+        return 0, False, start_time, time.perf_counter()
+
+def plan_table_tasks(table_name, chunks, journal, resume):
+    """
+    Return the copy tasks for one table. When resuming, the ranges recorded in the journal
+    are reused and only the unfinished ones are returned, starting at their last committed key.
+    """
+    recorded = journal.load_table(table_name) if resume else []
+    if recorded:
+        pending = [(chunk, pk_range, last_pk) for chunk, pk_range, last_pk, done in recorded if not done]
+        if not pending:
+            print(f"Table {table_name} was already transferred. Skipping.")
+            return []
+        print(f"Resuming table {table_name}: {len(pending)} of {len(recorded)} ranges left")
+        range_count = len(recorded)
+    else:
+        try:
+            pk_ranges = plan_table_ranges(table_name, chunks)
+        except Exception as e:
+            print(f"Failed to split table {table_name} into ranges, copying it whole.")
+            print(e)
+            pk_ranges = None
+
+        # A table without a usable key is copied as a single streamed task
+        pk_ranges = pk_ranges or [None]
+        journal.start_table(table_name, pk_ranges)
+        pending = [(chunk, pk_range, None) for chunk, pk_range in enumerate(pk_ranges)]
+        range_count = len(pk_ranges)
+
+    tasks = []
+    for chunk, pk_range, last_pk in pending:
+        tasks.append({
+            'table_name': table_name,
+            'chunk': chunk,
+            'pk_range': pk_range,
+            'last_pk': last_pk,
+            'resumed': bool(recorded),
+            'progress_name': table_name if range_count == 1 else f"{table_name}[{chunk + 1}/{range_count}]",
+        })
+    return tasks
+
+def transfer_level_data(executor, level, batch_size, chunks, journal, resume, bulk_load=False):
+    """
+    Copy the data for one dependency level, splitting each table into primary key ranges.
+    With `bulk_load`, the keys of the level's tables are disabled until all of their ranges are loaded.
+    Returns the tables whose copy failed.
+    """
+    tasks = []
+    for table_name in level:
+        print(f"Transferring data for table: {table_name}")
+        tasks.extend(plan_table_tasks(table_name, chunks, journal, resume))
+
+    loaded_tables = sorted({task['table_name'] for task in tasks})
+    if bulk_load:
+        set_keys_enabled(loaded_tables, False)
+    try:
+        results = list(executor.map(lambda task: run_copy_task(task, batch_size, journal, bulk_load), tasks))
+    finally:
+        if bulk_load:
+            set_keys_enabled(loaded_tables, True)
+
+    # Summarise each table once all of its ranges are done
+    failed_tables = []
+    for table_name in level:
+        table_results = [result for task, result in zip(tasks, results) if task['table_name'] == table_name]
+        if not table_results:
+            continue
+        total_rows = sum(result[0] for result in table_results)
+        start_time = min(result[2] for result in table_results)
+        end_time = max(result[3] for result in table_results)
+
+        if not all(result[1] for result in table_results):
+            failed_tables.append(table_name)
+            print(f"Data transfer for table {table_name} is incomplete ({total_rows} rows copied). Rerun with --resume to continue.")
+        elif total_rows == 0:
+            print(f"No data to transfer for table: {table_name}")
+        else:
+            rate = total_rows / (end_time - start_time) if end_time > start_time else 0
+            print(f"  {table_name}: {total_rows} rows finished in {end_time - start_time:.1f}s ({rate:.0f} rows/sec)")
+
+    return failed_tables
+
+def range_summary(conn, table_db1, pk_column, pk_range, with_checksum):
+    """
+    Return the row count of a primary key range (the whole table for None) and, with
+    `with_checksum`, a BIT_XOR of the per-row hashes compare_db uses, both computed by the MySQL server.
+    """
+    columns = [func.count()]
+    if with_checksum:
+        row_checksum = row_checksum_sql(conn, [column.name for column in table_db1.columns])
+        columns.append(literal_column(f"BIT_XOR({row_checksum})"))
+
+    query = select(*columns).select_from(table_db1)
+    if pk_range is not None:
+        query = query.where(pk_range_condition(pk_column, *pk_range))
+    return tuple(conn.execute(query).one())
+
+def mismatched_ranges(table_db1, pk_column, pk_ranges):
+    """Return the primary key ranges whose row count or checksum differs between db1 and db2."""
+    # Checksums are only comparable when both servers hash the same stored values
+    with_checksum = engine_db1.dialect.name == engine_db2.dialect.name == 'mysql'
+    with engine_db1.connect() as conn_db1, engine_db2.connect() as conn_db2:
+        return [
+            pk_range for pk_range in pk_ranges
+            if range_summary(conn_db1, table_db1, pk_column, pk_range, with_checksum)
+            != range_summary(conn_db2, table_db1, pk_column, pk_range, with_checksum)
+        ]
+
+def recopy_range(table_name, pk_column, pk_range, batch_size, bulk_load=False):
+    """
+    Replace the rows of one primary key range in db2 (the whole table for None) with those of db1:
+    the rows of the range are deleted from db2 before they are copied again.
+    """
+    table_db1 = metadata_db1.tables[table_name]
+    task = {
+        'table_name': table_name,
+        'chunk': None,
+        'pk_range': pk_range,
+        'last_pk': None,
+        'resumed': pk_range is None,
+        'progress_name': f"{table_name} (re-copy)",
+    }
+    if pk_range is None:
+        # copy_table_data clears the table in db2 before copying a resumed task
+        copy_table_data(task, batch_size, bulk_load)
+        return
+
+    with engine_db2.connect() as conn_db2:
+        conn_db2.execute(table_db1.delete().where(pk_range_condition(pk_column, *pk_range)))
+        conn_db2.commit()
+    copy_pk_range(task, batch_size, None, bulk_load)
+
+def verify_table(table_name, verify_ranges, batch_size, bulk_load=False, repair=False):
+    """
+    Compare a copied table between db1 and db2 per primary key range on the server side and
+    report the mismatching ranges. With `repair`, those ranges are copied again and checked once more.
+    Tables without a single-column primary key are compared and re-copied whole.
+    Returns True when db2 matches db1.
+    """
+    table_db1 = metadata_db1.tables[table_name]
+    pk_column = single_primary_key(table_db1)
+    if pk_column is None:
+        pk_ranges = [None]
+    else:
+        with engine_db1.connect() as conn_db1:
+            pk_ranges = split_pk_ranges(conn_db1, table_db1, pk_column, verify_ranges)
+
+    mismatched = mismatched_ranges(table_db1, pk_column, pk_ranges)
+    if not mismatched:
+        print(f"  {table_name}: verified ({len(pk_ranges)} ranges match)")
+        return True
+
+    if not repair:
+        print(f"  {table_name}: {len(mismatched)} of {len(pk_ranges)} ranges differ: {mismatched} "
+              "(rerun with --repair to copy them again)")
+        return False
+
+    print(f"  {table_name}: {len(mismatched)} of {len(pk_ranges)} ranges differ, copying them again")
+    for pk_range in mismatched:
+        recopy_range(table_name, pk_column, pk_range, batch_size, bulk_load)
+
+    mismatched = mismatched_ranges(table_db1, pk_column, mismatched)
+    if mismatched:
+        print(f"  {table_name}: {len(mismatched)} ranges still differ after copying them again: {mismatched}")
+        return False
+    print(f"  {table_name}: verified after copying the mismatching ranges again")
+    return True
+
+def verify_level_data(executor, level, verify_ranges, batch_size, bulk_load=False, repair=False):
+    """Verify the copied tables of one dependency level concurrently. Returns the tables that don't match."""
+    def verify(table_name):
+        try:
+            return verify_table(table_name, verify_ranges, batch_size, bulk_load, repair)
+        except Exception as e:
+            print(f"Failed to verify table: {table_name}")
+            print(f"Error: {e}")
+            return False
+
+    print(f"Verifying tables: {', '.join(level)}")
+    return [table_name for table_name, ok in zip(level, executor.map(verify, level)) if not ok]
+
+def watermark_column_for(table_db1, column_name):
+    """
+    Pick the column used to find changed rows: `column_name` when the table has it,
+    otherwise an integer primary key (which only detects new rows, not updates).
+    """
+    if column_name in table_db1.columns:
+        return table_db1.columns[column_name]
+    pk_column = single_primary_key(table_db1)
+    if pk_column is not None and isinstance(pk_column.type, Integer):
+        return pk_column
+    return None
+
+def sync_table_delta(table_name, watermark_column_name, batch_size, journal):
+    """
+    Upsert into db2 the rows of one table changed since the last sync, tracked by a
+    watermark column whose highest synced value is kept in the journal.
+    Returns the number of rows synced, or None when the table can't be synced incrementally.
+    """
+    table_db1 = metadata_db1.tables[table_name]
+    watermark_column = watermark_column_for(table_db1, watermark_column_name)
+    if watermark_column is None or single_primary_key(table_db1) is None:
+        print(f"Table {table_name} has no '{watermark_column_name}' column or no single-column primary key. "
+              "Skipping incremental sync, copy it without --incremental.")
+        return None
+
+    watermark = journal.load_watermark(table_name, watermark_column.name)
+    query = table_db1.select().order_by(watermark_column)
+    if watermark is not None:
+        # Timestamps are not unique, so rows sharing the last watermark are synced again
+        if watermark_column.primary_key:
+            query = query.where(watermark_column > watermark)
+        else:
+            query = query.where(watermark_column >= watermark)
+        print(f"Syncing {table_name} rows with {watermark_column.name} after {watermark}")
+    else:
+        print(f"No watermark recorded for {table_name}, syncing all rows")
+
+    start_time = time.perf_counter()
+    total_rows = 0
+
+    with engine_db1.connect() as conn_db1, engine_db2.connect() as conn_db2:
+        for batch in fetch_batches(conn_db1, table_db1, batch_size, query=query):
+            upsert_batch(conn_db2, table_db1, batch)
+            conn_db2.commit()
+
+            # Rows arrive ordered by the watermark, so every committed batch advances it
+            last_value = batch[-1]._mapping[watermark_column]
+            if last_value is not None:
+                journal.save_watermark(table_name, watermark_column.name, last_value)
+
+            total_rows += len(batch)
+            print_progress(table_name, total_rows, start_time, label="rows synced")
+
+    return total_rows
+
+def sync_level_data(executor, level, batch_size, journal, watermark_column_name):
+    """Sync the changed rows of every table in one dependency level concurrently. Returns the tables that failed."""
+    def sync(table_name):
+        try:
+            total_rows = sync_table_delta(table_name, watermark_column_name, batch_size, journal)
+            if total_rows is None:
+                return False  # Reported as not transferred
+            if total_rows == 0:
+                print(f"No changes to sync for table: {table_name}")
+            return True
+        except Exception as e:
+            print(f"Failed to sync data for table: {table_name}")
+            print(f"Error: {e}")
+            return False
+
+    return [table_name for table_name, ok in zip(level, executor.map(sync, level)) if not ok]
+
+def transfer_structure_and_data(selected_tables, batch_size=DEFAULT_BATCH_SIZE, jobs=1, chunks=1,
+                                resume=False, journal_path=DEFAULT_JOURNAL_PATH, incremental=False,
+                                watermark_column=DEFAULT_WATERMARK_COLUMN, bulk_load=False,
+                                verify=True, verify_ranges=DEFAULT_VERIFY_RANGES, repair=False):
+    """
+    Transfer the structure (table definitions) and data for selected tables from db1 to db2.
+    Rows are read from db1 and bulk-inserted into db2 in batches of batch_size rows, so memory
+    use stays flat regardless of the table size.
+    Up to `jobs` copies run concurrently, each worker holding one connection to each
+    database. Tables referenced through foreign keys are copied before the tables that use them.
+    Tables with a single-column primary key are split into `chunks` key ranges that are
+    copied in parallel; other tables are streamed whole.
+    Progress is checkpointed in a local journal; with `resume` unfinished ranges continue
+    from their last committed key instead of being copied again.
+    With `incremental`, only rows changed since the previous run are upserted into db2,
+    tracked per table by `watermark_column` (or an integer primary key).
+    With `bulk_load`, full copies load each batch through db2's bulk loader (LOAD DATA LOCAL
+    INFILE or COPY) instead of INSERT statements, falling back to inserts when it is unavailable.
+    With `verify`, every copied table is compared with db1 in `verify_ranges` primary key ranges
+    (row counts, plus checksums between MySQL servers) and mismatching ranges are reported;
+    with `repair` they are deleted from db2 and copied again.
+    Returns True when every table was transferred (and verified) successfully.
+    """
+    levels = dependency_levels(selected_tables)
+    journal = CheckpointJournal(journal_path)
+    size_connection_pools(jobs)
+
+    # Create the structures first, parents before children
+    with engine_db2.connect() as conn_db2:
+        for level in levels:
+            for table_name in level:
+                create_table_structure(conn_db2, table_name)
+
+    # Copy the data one dependency level at a time
+    failed_tables = []
+    try:
+        with ThreadPoolExecutor(max_workers=jobs) as executor:
+            for level in levels:
+                # Rows of tables referencing a table that wasn't transferred would point at missing parents
+                orphaned = [table_name for table_name in level if referenced_tables(table_name) & set(failed_tables)]
+                if orphaned:
+                    print(f"\nSkipping tables that reference tables not transferred: {', '.join(orphaned)}")
+                    failed_tables += orphaned
+                    level = [table_name for table_name in level if table_name not in orphaned]
+                if not level:
+                    continue
+
+                print(f"\nProcessing tables: {', '.join(level)}")
+                if incremental:
+                    failed_tables += sync_level_data(executor, level, batch_size, journal, watermark_column)
+                    continue
+
+                level_failed = transfer_level_data(executor, level, batch_size, chunks, journal, resume, bulk_load)
+                failed_tables += level_failed
+                if verify:
+                    copied = [table_name for table_name in level if table_name not in level_failed]
+                    failed_tables += verify_level_data(executor, copied, verify_ranges, batch_size, bulk_load, repair)
+    finally:
+        journal.close()
+
+    if failed_tables:
+        print(f"\nTransfer finished with errors. Tables not transferred completely: {', '.join(failed_tables)}")
+        return False
     print("\nData and structure transfer complete.")
+    return True
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transfer table structure and data from db1 to db2.")
+    parser.add_argument("--batch-size", type=int, default=DEFAULT_BATCH_SIZE,
+                        help="Number of rows read and written per batch (default: %(default)s)")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of tables or key ranges copied concurrently, each with its own connection pair (default: %(default)s)")
+    parser.add_argument("--chunks", type=int, default=1,
+                        help="Split each table into this many primary key ranges copied in parallel (default: %(default)s)")
+    parser.add_argument("--resume", action="store_true",
+                        help="Continue an interrupted transfer from the checkpoint journal instead of starting over")
+    parser.add_argument("--journal", default=DEFAULT_JOURNAL_PATH,
+                        help="Path of the local checkpoint journal (default: %(default)s)")
+    parser.add_argument("--incremental", action="store_true",
+                        help="Upsert only the rows changed since the last run, using per-table watermarks kept in the journal")
+    parser.add_argument("--watermark-column", default=DEFAULT_WATERMARK_COLUMN,
+                        help="Column tracking row changes in incremental mode; tables without it use an integer primary key (default: %(default)s)")
+    parser.add_argument("--bulk-load", action="store_true",
+                        help="Load full copies with LOAD DATA LOCAL INFILE (MySQL, needs local_infile=1 in db2_url) or COPY (PostgreSQL), "
+                             "falling back to batched inserts; use a larger --batch-size with it. "
+                             "Non-unique indexes are only disabled during the load for MyISAM tables")
+    parser.add_argument("--skip-verify", action="store_true",
+                        help="Don't compare the copied tables with db1 after copying them")
+    parser.add_argument("--verify-ranges", type=int, default=DEFAULT_VERIFY_RANGES,
+                        help="Number of primary key ranges compared per table when verifying (default: %(default)s)")
+    parser.add_argument("--repair", action="store_true",
+                        help="Copy the ranges that fail verification again, deleting their rows in db2 first "
+                             "(the whole table for tables without a single-column primary key)")
+    args = parser.parse_args()
+
     # List all tables from db1
     available_tables = list_tables()
 
@@ -134,4 +830,10 @@ if __name__ == "__main__":
     selected_tables = select_tables(available_tables)
 
     # Transfer structure and data for the selected tables
-    transfer_structure_and_data(selected_tables)
+    succeeded = transfer_structure_and_data(selected_tables, batch_size=args.batch_size, jobs=args.jobs,
+                                            chunks=args.chunks, resume=args.resume, journal_path=args.journal,
+                                            incremental=args.incremental, watermark_column=args.watermark_column,
+                                            bulk_load=args.bulk_load, verify=not args.skip_verify,
+                                            verify_ranges=args.verify_ranges, repair=args.repair)
+    if not succeeded:
+        raise SystemExit(1)
@@ -0,0 +1,52 @@
+import datetime
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# transfer_table connects to the databases in compare_db_config on import, use in-memory SQLite instead
+compare_db_config = types.ModuleType('compare_db_config')
+compare_db_config.db1_url = compare_db_config.db2_url = 'sqlite://'
+sys.modules.setdefault('compare_db_config', compare_db_config)
+
+from transfer_table import bulk_field
+
+
+class BulkFieldTest(unittest.TestCase):
+    def test_null(self):
+        self.assertEqual(bulk_field(None, 'mysql'), b'\\N')
+        self.assertEqual(bulk_field(None, 'postgresql'), b'\\N')
+
+    def test_delimiters_and_backslashes_are_escaped(self):
+        self.assertEqual(bulk_field('a\tb\nc\rd\\e', 'postgresql'), b'a\\tb\\nc\\rd\\\\e')
+        self.assertEqual(bulk_field('\\N', 'mysql'), b'\\\\N')
+
+    def test_nul_is_escaped_for_mysql_only(self):
+        self.assertEqual(bulk_field(b'a\0b', 'mysql'), b'a\\0b')
+        self.assertEqual(bulk_field('a\0b', 'postgresql'), b'a\0b')
+
+    def test_bytes(self):
+        self.assertEqual(bulk_field(b'\x00\xff\t', 'mysql'), b'\\0\xff\\t')
+        self.assertEqual(bulk_field(memoryview(b'\x00\xff'), 'postgresql'), b'\\\\x00ff')
+
+    def test_text_is_utf8(self):
+        self.assertEqual(bulk_field('café', 'mysql'), 'café'.encode('utf-8'))
+
+    def test_bool(self):
+        self.assertEqual(bulk_field(True, 'mysql'), b'1')
+        self.assertEqual(bulk_field(False, 'postgresql'), b'f')
+
+    def test_timedelta_beyond_a_day(self):
+        value = datetime.timedelta(days=1, hours=2, seconds=3, microseconds=7)
+        self.assertEqual(bulk_field(value, 'mysql'), b'26:00:03.000007')
+        self.assertEqual(bulk_field(-datetime.timedelta(minutes=90), 'postgresql'), b'-1:30:00.000000')
+
+    def test_json_and_set(self):
+        self.assertEqual(bulk_field({'a': [1, 'x\ty']}, 'mysql'), b'{"a": [1, "x\\\\ty"]}')
+        self.assertEqual(bulk_field({'y', 'x'}, 'mysql'), b'x,y')
+
+
+if __name__ == '__main__':
+    unittest.main()
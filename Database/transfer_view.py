@@ -1,4 +1,8 @@
+import argparse
 import compare_db_config
+import re
+from concurrent.futures import ThreadPoolExecutor
+from dependency_order import order_levels
 from sqlalchemy import create_engine, text, inspect
 from sqlalchemy.orm import sessionmaker
 
@@ -13,10 +17,12 @@ SessionDB2 = sessionmaker(bind=engine_db2)
 session_db1 = SessionDB1()
 session_db2 = SessionDB2()
 
+# One inspector for db1, shared by every lookup so reflection results are cached
+inspector_db1 = inspect(engine_db1)
+
 def list_views():
     """List all the views in the source database (db1)"""
-    inspector = inspect(engine_db1)  # Correct method to get inspector
-    views = inspector.get_view_names()
+    views = inspector_db1.get_view_names()
 
     print("Available views in db1:")
     for idx, view_name in enumerate(views, start=1):
@@ -32,20 +38,148 @@ def select_views(views):
     
     return selected_views
 
-def transfer_view(view_name):
-    """Transfer a view by extracting its definition and creating it in db2."""
-    inspector = inspect(engine_db1)
-    view_definition = inspector.get_view_definition(view_name)
-    
-    # Strip out 'DEFINER' and 'SQL SECURITY' and any extra 'CREATE' keywords
-    cleaned_view_definition = view_definition.replace('DEFINER=`root`@`%`', '').replace('SQL SECURITY DEFINER', '')
-    cleaned_view_definition = cleaned_view_definition.replace('CREATE ALGORITHM=UNDEFINED', '')
-    cleaned_view_definition = cleaned_view_definition.replace('CREATE VIEW', '').strip()
-    cleaned_view_definition = cleaned_view_definition.replace('VIEW', '').strip()
-    cleaned_view_definition = cleaned_view_definition.replace(f'`{view_name}` AS', '').strip()
+# Quoted identifiers, strings, comments, whitespace, words and single characters of a SQL statement
+SQL_TOKEN_PATTERN = re.compile(r"""
+    `(?:[^`]|``)*`
+  | '(?:[^'\\]|\\.|'')*'
+  | "(?:[^"\\]|\\.|"")*"
+  | --[^\n]*
+  | /\*.*?\*/
+  | \s+
+  | [\w$]+
+  | .
+""", re.VERBOSE | re.DOTALL)
+
+def tokenize_sql(sql):
+    """Split SQL into tokens; joining the tokens gives back the original text."""
+    return SQL_TOKEN_PATTERN.findall(sql)
+
+def is_trivia(token):
+    """Whitespace and comments, which never change the meaning of a statement."""
+    return token.isspace() or token.startswith('--') or token.startswith('/*')
+
+def identifier_name(token):
+    """Return the identifier a token names (bare word or `quoted`), or None for strings and symbols."""
+    if token.startswith('`'):
+        return token[1:-1].replace('``', '`')
+    if re.fullmatch(r"[\w$]+", token):
+        return token
+    return None
+
+def clean_view_definition(view_definition, schema_name=None):
+    """
+    Reduce a view definition to its optional column list and its SELECT body.
+    A leading CREATE [ALGORITHM=...] [DEFINER=...] [SQL SECURITY ...] VIEW name header is
+    dropped whatever the definer is, and identifiers qualified with schema_name lose the
+    qualifier. Works on tokens, so strings, comments and identifiers containing keywords
+    such as VIEW are never altered.
+    """
+    tokens = tokenize_sql(view_definition)
+    positions = [idx for idx, token in enumerate(tokens) if not is_trivia(token)]
+    column_list = ''
+    body_start = 0
+
+    if positions and tokens[positions[0]].upper() == 'CREATE':
+        # Definer accounts are quoted, so the first bare VIEW word ends the header options
+        pos = next((n for n, idx in enumerate(positions) if tokens[idx].upper() == 'VIEW'), None)
+        if pos is None:
+            raise ValueError("View definition has a CREATE header without VIEW")
+
+        # Skip the view name, which may be qualified with its schema
+        pos += 2
+        while pos + 1 < len(positions) and tokens[positions[pos]] == '.':
+            pos += 2
+
+        # Keep an explicit column list, it names the view's columns
+        if pos < len(positions) and tokens[positions[pos]] == '(':
+            list_start = positions[pos]
+            depth = 0
+            while pos < len(positions):
+                token = tokens[positions[pos]]
+                depth += {'(': 1, ')': -1}.get(token, 0)
+                pos += 1
+                if depth == 0:
+                    break
+            column_list = ''.join(tokens[list_start:positions[pos - 1] + 1])
+
+        if pos >= len(positions) or tokens[positions[pos]].upper() != 'AS':
+            raise ValueError("View definition header is not followed by AS")
+        body_start = positions[pos] + 1
+
+    body = []
+    tokens = tokens[body_start:]
+    idx = 0
+    while idx < len(tokens):
+        if (schema_name is not None and identifier_name(tokens[idx]) == schema_name
+                and idx + 1 < len(tokens) and tokens[idx + 1] == '.'):
+            idx += 2
+            continue
+        body.append(tokens[idx])
+        idx += 1
+
+    return column_list, ''.join(body).strip()
+
+def format_column_list(column_names):
+    """Build the explicit column list of a view, quoted for db2 (empty when no columns are known)."""
+    if not column_names:
+        return ''
+    quote = engine_db2.dialect.identifier_preparer.quote
+    return f"({', '.join(quote(column_name) for column_name in column_names)})"
+
+def fetch_view_definitions():
+    """
+    Fetch the cleaned definition of every view in db1 as {view_name: (column_list, body)}.
+    The column list always names the view's columns as db1 reports them, since the stored
+    definition is only the SELECT body and its own column names may differ (v (x) AS SELECT a).
+    On MySQL the definitions and the columns are read with one information_schema query each.
+    """
+    if engine_db1.dialect.name != 'mysql':
+        view_definitions = {}
+        for view_name in inspector_db1.get_view_names():
+            _, body = clean_view_definition(inspector_db1.get_view_definition(view_name))
+            column_names = [column['name'] for column in inspector_db1.get_columns(view_name)]
+            view_definitions[view_name] = (format_column_list(column_names), body)
+        return view_definitions
+
+    with engine_db1.connect() as conn_db1:
+        views = conn_db1.execute(text(
+            "SELECT TABLE_SCHEMA, TABLE_NAME, VIEW_DEFINITION FROM information_schema.VIEWS "
+            "WHERE TABLE_SCHEMA = DATABASE()"
+        )).fetchall()
+        columns = conn_db1.execute(text(
+            "SELECT c.TABLE_NAME, c.COLUMN_NAME FROM information_schema.COLUMNS c "
+            "JOIN information_schema.VIEWS v ON v.TABLE_SCHEMA = c.TABLE_SCHEMA AND v.TABLE_NAME = c.TABLE_NAME "
+            "WHERE c.TABLE_SCHEMA = DATABASE() ORDER BY c.TABLE_NAME, c.ORDINAL_POSITION"
+        )).fetchall()
+
+    view_columns = {}
+    for view_name, column_name in columns:
+        view_columns.setdefault(view_name, []).append(column_name)
+
+    view_definitions = {}
+    for schema_name, view_name, view_definition in views:
+        if not view_definition:
+            # MySQL hides the definition from users who are neither its definer nor have SHOW VIEW
+            print(f"No definition visible for view {view_name}, check the SHOW VIEW privilege.")
+        _, body = clean_view_definition(view_definition or '', schema_name)
+        view_definitions[view_name] = (format_column_list(view_columns.get(view_name, [])), body)
+    return view_definitions
+
+def view_dependencies(view_definitions, view_names):
+    """Map every view to the views among view_names that its definition references."""
+    dependencies = {}
+    for view_name, (column_list, body) in view_definitions.items():
+        identifiers = {identifier_name(token) for token in tokenize_sql(body)}
+        dependencies[view_name] = (identifiers & set(view_names)) - {view_name}
+    return dependencies
+
+def transfer_view(view_name, column_list, view_body):
+    """Transfer a view by creating it in db2 from its cleaned db1 definition."""
+    quoted_name = engine_db2.dialect.identifier_preparer.quote(view_name)
+    column_list = f" {column_list}" if column_list else ""
 
     # Generate the final view creation SQL
-    create_view_sql = f"CREATE VIEW {view_name} AS {cleaned_view_definition}"
+    create_view_sql = f"CREATE VIEW {quoted_name}{column_list} AS {view_body}"
 
     print(f"Creating view in db2: {view_name}")
     print(f"View definition: {create_view_sql}")
@@ -53,18 +187,50 @@ def transfer_view(view_name):
     try:
         with engine_db2.connect() as conn_db2:
             conn_db2.execute(text(create_view_sql))
+            conn_db2.commit()
             print(f"Successfully created view: {view_name}")
     except Exception as e:
         print(f"Failed to create view {view_name}: {e}")
 
-def transfer_views(selected_views):
-    """Transfer all selected views to db2"""
-    for view_name in selected_views:
-        transfer_view(view_name)
+def size_connection_pool(jobs):
+    """
+    Recreate the db2 engine with a pool of at least `jobs` connections, as every worker holds
+    one connection while it creates a view and the default pool would make extra workers time out.
+    """
+    global engine_db2
+    if jobs <= engine_db2.pool.size():
+        return
+    engine_db2.dispose()
+    engine_db2 = create_engine(compare_db_config.db2_url, pool_size=jobs)
+
+def transfer_views(selected_views, jobs=1):
+    """
+    Transfer all selected views to db2. Views are created after the views they depend on,
+    and the independent views of each dependency level are created concurrently on pooled connections.
+    """
+    all_definitions = fetch_view_definitions()
+    view_definitions = {view_name: all_definitions[view_name] for view_name in selected_views}
+    dependencies = view_dependencies(view_definitions, selected_views)
+    size_connection_pool(jobs)
+
+    # Views referencing unselected views only work if those already exist in db2
+    unselected_views = set(all_definitions) - set(selected_views)
+    for view_name, missing in view_dependencies(view_definitions, unselected_views).items():
+        if missing:
+            print(f"View {view_name} depends on views that were not selected: {', '.join(sorted(missing))}")
+
+    with ThreadPoolExecutor(max_workers=jobs) as executor:
+        for level in order_levels(dependencies):
+            list(executor.map(lambda view_name: transfer_view(view_name, *view_definitions[view_name]), level))
 
     print("\nView transfer complete.")
 
 if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Transfer views from db1 to db2.")
+    parser.add_argument("--jobs", type=int, default=1,
+                        help="Number of independent views created concurrently (default: %(default)s)")
+    args = parser.parse_args()
+
     # List all views from db1
     available_views = list_views()
 
@@ -72,4 +238,4 @@ if __name__ == "__main__":
     selected_views = select_views(available_views)
 
     # Transfer the selected views
-    transfer_views(selected_views)
+    transfer_views(selected_views, jobs=args.jobs)
@@ -0,0 +1,77 @@
+import os
+import sys
+import types
+import unittest
+
+sys.path.insert(0, os.path.dirname(os.path.abspath(__file__)))
+
+# transfer_view connects to the databases in compare_db_config on import, use in-memory SQLite instead
+compare_db_config = types.ModuleType('compare_db_config')
+compare_db_config.db1_url = compare_db_config.db2_url = 'sqlite://'
+sys.modules.setdefault('compare_db_config', compare_db_config)
+
+from sqlalchemy import text
+
+import transfer_view
+
+
+class TokenizeSqlTest(unittest.TestCase):
+    def test_tokens_join_back_to_the_original(self):
+        sql = "SELECT `a``b`, 'it''s', \"x\" -- note\nFROM t /* c */ WHERE a = 1"
+        self.assertEqual(''.join(transfer_view.tokenize_sql(sql)), sql)
+
+    def test_strings_and_comments_are_single_tokens(self):
+        tokens = transfer_view.tokenize_sql("SELECT 'a view' /* VIEW */ FROM v")
+        self.assertIn("'a view'", tokens)
+        self.assertIn("/* VIEW */", tokens)
+
+
+class CleanViewDefinitionTest(unittest.TestCase):
+    def test_create_header_is_dropped_and_column_list_kept(self):
+        definition = ("CREATE ALGORITHM=UNDEFINED DEFINER=`admin`@`%` SQL SECURITY DEFINER "
+                      "VIEW `shop`.`v` (`x`, `y`) AS select `a`, `b` from `t`")
+        self.assertEqual(transfer_view.clean_view_definition(definition),
+                         ("(`x`, `y`)", "select `a`, `b` from `t`"))
+
+    def test_body_without_header_has_no_column_list(self):
+        self.assertEqual(transfer_view.clean_view_definition("select 1 AS `one`"), ('', "select 1 AS `one`"))
+
+    def test_schema_qualifiers_are_removed_outside_strings(self):
+        column_list, body = transfer_view.clean_view_definition(
+            "select `shop`.`t`.`a` AS `a`, 'shop.t' AS `s` from `shop`.`t`", 'shop'
+        )
+        self.assertEqual(body, "select `t`.`a` AS `a`, 'shop.t' AS `s` from `t`")
+
+    def test_view_keyword_inside_identifiers_is_kept(self):
+        definition = "CREATE VIEW `v` AS select `view_count` from `review`"
+        self.assertEqual(transfer_view.clean_view_definition(definition)[1], "select `view_count` from `review`")
+
+    def test_header_without_as_is_rejected(self):
+        with self.assertRaises(ValueError):
+            transfer_view.clean_view_definition("CREATE VIEW `v` select 1")
+
+
+class ViewDependenciesTest(unittest.TestCase):
+    def test_views_come_after_the_views_they_select_from(self):
+        definitions = {
+            'v_top': ('', "select * from `v_mid`"),
+            'v_mid': ('', "select * from v_base join t on 1"),
+            'v_base': ('', "select 'v_top' from t"),
+        }
+        dependencies = transfer_view.view_dependencies(definitions, list(definitions))
+        self.assertEqual(dependencies, {'v_top': {'v_mid'}, 'v_mid': {'v_base'}, 'v_base': set()})
+        self.assertEqual(transfer_view.order_levels(dependencies), [['v_base'], ['v_mid'], ['v_top']])
+
+
+class FetchViewDefinitionsTest(unittest.TestCase):
+    def test_column_list_comes_from_the_view_columns(self):
+        with transfer_view.engine_db1.connect() as conn:
+            conn.execute(text("CREATE TABLE t (a INTEGER)"))
+            conn.execute(text("CREATE VIEW v (x) AS SELECT a FROM t"))
+            conn.commit()
+
+        self.assertEqual(transfer_view.fetch_view_definitions(), {'v': ('(x)', 'SELECT a FROM t')})
+
+
+if __name__ == '__main__':
+    unittest.main()